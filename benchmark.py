@@ -0,0 +1,253 @@
+"""Benchmark refreshes against a local stand-in for the Nexus API.
+
+Serves stations and platforms from the bundled JSON and synthetic times
+payloads with a configurable latency, then drives MetroNetwork and
+MetroDataUpdateCoordinator refreshes for 1, 10 and all platforms, with and
+without reusing departure records for unchanged trains, and estimates the
+position of every train they turned up. Pass a capture archive to replay
+recorded responses instead.
+
+    python benchmark.py --latency 50 --iterations 20
+    python benchmark.py --replay tyne_and_wear_metro_capture.jsonl.gz --speed 100
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+import json
+from pathlib import Path
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from aiohttp import web
+
+from custom_components.tyne_and_wear_metro.coordinator import MetroDataUpdateCoordinator
+from custom_components.tyne_and_wear_metro.metro import (
+    MetroAPI,
+    MetroNetwork,
+    MetroReplayAPI,
+)
+from custom_components.tyne_and_wear_metro.positions import MetroPositionEstimator
+from homeassistant.core import HomeAssistant
+
+ROOT = Path(__file__).parent
+
+
+class StandInNexus:
+    """A local aiohttp server answering the endpoints MetroAPI uses."""
+
+    def __init__(self, latency: float, trains_per_platform: int) -> None:
+        self.latency, self.trains_per_platform = latency, trains_per_platform
+        self.stations = json.loads((ROOT / "stations.json").read_text())
+        self.platforms = json.loads((ROOT / "platforms.json").read_text())
+        self.requests = 0
+        self.runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/api/stations", self.get_stations)
+        app.router.add_get("/api/stations/platforms", self.get_platforms)
+        app.router.add_get("/api/times/{station}/{platform}", self.get_times)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # noqa: SLF001
+        self.url = f"http://127.0.0.1:{port}/api/"
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def _respond(self, payload) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response(payload)
+
+    async def get_stations(self, request: web.Request) -> web.Response:
+        return await self._respond(self.stations)
+
+    async def get_platforms(self, request: web.Request) -> web.Response:
+        return await self._respond(self.platforms)
+
+    async def get_times(self, request: web.Request) -> web.Response:
+        station_code = request.match_info["station"]
+        platform_code = request.match_info["platform"]
+        name = self.stations[station_code]
+        if station_code in ("MTS", "MTW"):
+            name = "Monument"
+        # Like the real feed, predictions only move from minute to minute
+        now = datetime.now().astimezone().replace(second=0, microsecond=0)
+        trains = []
+        for i in range(self.trains_per_platform):
+            due = now + timedelta(minutes=2 + 6 * i)
+            trains.append(
+                {
+                    "trn": f"{hash((station_code, platform_code, i)) % 1000:03}",
+                    "line": "GREEN",
+                    "destination": "South Hylton",
+                    "lastEvent": "DEPARTED",
+                    "lastEventLocation": f"{name} Platform {platform_code}",
+                    "lastEventTime": (now - timedelta(minutes=1)).isoformat(),
+                    "dueIn": 2 + 6 * i,
+                    "actualPredictedTime": due.isoformat(),
+                    "actualScheduledTime": due.isoformat(),
+                }
+            )
+        return await self._respond(trains)
+
+
+async def measure(
+    name: str,
+    requests: Callable[[], int],
+    iterations: int,
+    prepare: Callable[[], None],
+    run: Callable[[], Awaitable],
+) -> None:
+    latencies = []
+    cpu = 0.0
+    requests_before = requests()
+    tracemalloc.start()
+    for _ in range(iterations):
+        prepare()
+        start, start_cpu = time.perf_counter(), time.process_time()
+        await run()
+        latencies.append((time.perf_counter() - start) * 1000)
+        cpu += time.process_time() - start_cpu
+    _, peak = tracemalloc.get_traced_memory()
+    allocations = sum(
+        stat.count for stat in tracemalloc.take_snapshot().statistics("filename")
+    )
+    tracemalloc.stop()
+    quantiles = (
+        statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    )
+    print(
+        f"{name:<28} p50 {quantiles[49]:8.1f}ms  p90 {quantiles[89]:8.1f}ms  "
+        f"p99 {quantiles[98]:8.1f}ms  cpu {cpu / iterations * 1000:7.2f}ms  "
+        f"requests {(requests() - requests_before) / iterations:6.1f}  "
+        f"live blocks {allocations:7}  peak {peak / 1024:8.1f}KiB"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    server = None
+    if args.replay:
+        api = MetroReplayAPI(args.replay, speed=args.speed or None)
+        await api.async_load()
+
+        def requests() -> int:
+            return api.cache_misses
+    else:
+        server = StandInNexus(args.latency / 1000, args.trains)
+        await server.start()
+        api = MetroAPI()
+        api.API_BASE = server.url
+
+        def requests() -> int:
+            return server.requests
+
+    network = MetroNetwork(api)
+    hass = HomeAssistant(tempfile.mkdtemp())
+    options = {"history": False}
+    try:
+        await measure(
+            "hydrate",
+            requests,
+            args.iterations,
+            api.clear_cache,
+            lambda: MetroNetwork(api).hydrate(),
+        )
+        await network.hydrate()
+        if server is not None:
+            await measure(
+                "revalidate",
+                requests,
+                args.iterations,
+                api.clear_cache,
+                network.revalidate,
+            )
+        platforms = [
+            (platform.station.station_code, platform.platform_code)
+            for platform in network.list_platforms()
+            if server is not None
+            or f"times/{platform.station.station_code}/{platform.platform_code}"
+            in api.paths
+        ]
+        for count in sorted(
+            {min(1, len(platforms)), min(10, len(platforms)), len(platforms)}
+        ):
+            subset = platforms[:count]
+
+            async def update_network(subset=subset) -> None:
+                await asyncio.gather(
+                    *(network.update(station, platform) for station, platform in subset)
+                )
+
+            await measure(
+                f"network.update x{count}",
+                requests,
+                args.iterations,
+                api.clear_cache,
+                update_network,
+            )
+
+            for incremental in (False, True):
+                coordinator = MetroDataUpdateCoordinator(
+                    hass, "benchmark", network, options
+                )
+                coordinator.INCREMENTAL = incremental
+
+                def subscribe(coordinator=coordinator, subset=subset) -> None:
+                    api.clear_cache()
+                    for station, platform in subset:
+                        coordinator.data["refreshed"][station][platform] = None
+                        coordinator.subscribe(station, platform)
+
+                await measure(
+                    f"coordinator x{count}{' incremental' if incremental else ''}",
+                    requests,
+                    args.iterations,
+                    subscribe,
+                    coordinator._async_update_data,  # noqa: SLF001
+                )
+                if incremental:
+                    print(
+                        f"{'':<28} records built {coordinator.records_built}, "
+                        f"reused {coordinator.records_reused}"
+                    )
+
+        estimator = MetroPositionEstimator(network)
+
+        async def estimate() -> None:
+            estimator.estimate()
+
+        await measure(
+            f"positions x{len(network.trains)}",
+            requests,
+            args.iterations,
+            lambda: None,
+            estimate,
+        )
+    finally:
+        await network.close()
+        if server is not None:
+            await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--latency", type=float, default=50, help="milliseconds")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--trains", type=int, default=4, help="per platform")
+    parser.add_argument("--replay", help="capture archive to replay instead")
+    parser.add_argument(
+        "--speed", type=float, default=1, help="replay speed, 0 for as fast as asked"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -2,38 +2,75 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from collections.abc import Mapping
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any
 
 from homeassistant.const import Platform
+from homeassistant.core import callback
+from homeassistant.helpers import config_validation as cv, entity_registry as er
+from homeassistant.helpers.dispatcher import async_dispatcher_send
 
-from .const import DOMAIN
-from .coordinator import MetroDataUpdateCoordinator
+from .const import (
+    _LOGGER,
+    CONF_APPROACH_DISTANCE,
+    CONF_PERSONS,
+    CONF_PLATFORMS,
+    CONF_PRESENCE_LEASE_LENGTH,
+    CONF_STATIONS,
+    DEFAULT_APPROACH_DISTANCE,
+    DEFAULT_OPTIONS,
+    DEFAULT_PRESENCE_LEASE_LENGTH,
+    DOMAIN,
+    SIGNAL_PLATFORMS_CHANGED,
+)
 from .data import MetroData
-from .metro import MetroNetwork
+from .presence import MetroPresence
+from .services import async_setup_services
+from .shared import MetroSharedNetworks
 
 if TYPE_CHECKING:
     from homeassistant.core import HomeAssistant
+    from homeassistant.helpers.typing import ConfigType
 
     from .data import MetroConfigEntry
 
-PLATFORMS: list[Platform] = [Platform.SENSOR]
+PLATFORMS: list[Platform] = [Platform.CAMERA, Platform.SENSOR]
+
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """Set up the Tyne and Wear Metro services."""
+    hass.data[DOMAIN] = MetroSharedNetworks(hass)
+    async_setup_services(hass)
+    return True
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: MetroConfigEntry) -> bool:
     """Set up Tyne and Wear Metro from a config entry."""
-    api = MetroNetwork()
-    await api.hydrate()
-    coordinator = MetroDataUpdateCoordinator(
-        hass,
-        name=DOMAIN,
-        api=api,
-        config_entry=entry,
-    )
+    shared = await hass.data[DOMAIN].async_acquire(entry)
     entry.runtime_data = MetroData(
-        api=api,
-        coordinator=coordinator,
+        api=shared.network,
+        coordinator=shared.coordinator,
+        planner=shared.planner,
+        shared=shared,
+        options=dict(entry.options),
     )
-    await coordinator.async_config_entry_first_refresh()
+    if persons := entry.options.get(CONF_PERSONS):
+        presence = entry.runtime_data.presence = MetroPresence(
+            hass,
+            shared,
+            lease_length=timedelta(
+                minutes=entry.options.get(
+                    CONF_PRESENCE_LEASE_LENGTH, DEFAULT_PRESENCE_LEASE_LENGTH
+                )
+            ),
+            approach_distance=entry.options.get(
+                CONF_APPROACH_DISTANCE, DEFAULT_APPROACH_DISTANCE
+            ),
+        )
+        entry.async_on_unload(presence.async_start(persons))
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
     entry.async_on_unload(entry.add_update_listener(async_reload_entry))
     return True
@@ -41,10 +78,62 @@ async def async_setup_entry(hass: HomeAssistant, entry: MetroConfigEntry) -> boo
 
 async def async_unload_entry(hass: HomeAssistant, entry: MetroConfigEntry) -> bool:
     """Unload a config entry."""
-    return await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
+    if unload_ok := await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
+        # Kept for a while after the last entry goes, so that a reload is
+        # quick, unless Home Assistant is stopping
+        await hass.data[DOMAIN].async_release(
+            entry.entry_id, entry.runtime_data.shared, linger=not hass.is_stopping
+        )
+    return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: MetroConfigEntry) -> None:
+    """Close a network left unused by a removed entry."""
+    await hass.data[DOMAIN].async_close_unused()
+
+
+async def async_migrate_entry(hass: HomeAssistant, entry: MetroConfigEntry) -> bool:
+    """Prefix unique IDs with the entry, now that there can be several."""
+    if entry.version > 2:
+        return False
+    if entry.version == 1:
+
+        @callback
+        def _prefix(entity_entry: er.RegistryEntry) -> dict[str, Any] | None:
+            if entity_entry.unique_id.startswith(f"{entry.entry_id}_"):
+                return None
+            return {"new_unique_id": f"{entry.entry_id}_{entity_entry.unique_id}"}
+
+        await er.async_migrate_entries(hass, entry.entry_id, _prefix)
+        hass.config_entries.async_update_entry(entry, version=2)
+        _LOGGER.debug("Migrated %s to version 2", entry.title)
+    return True
+
+
+def _without_selection(options: Mapping[str, Any]) -> dict[str, Any]:
+    return {
+        key: value
+        for key, value in {**DEFAULT_OPTIONS, **options}.items()
+        if key not in (CONF_STATIONS, CONF_PLATFORMS)
+    }
 
 
 async def async_reload_entry(hass: HomeAssistant, entry: MetroConfigEntry) -> None:
-    """Reload config entry."""
-    await async_unload_entry(hass, entry)
-    await async_setup_entry(hass, entry)
+    """Reload config entry, or just add and remove platforms if that is all."""
+    data = entry.runtime_data
+    if _without_selection(data.options) == _without_selection(entry.options):
+        keys = data.api.platform_data.keys()
+        before = {key for key in keys if data.is_selected(*key)}
+        data.options = dict(entry.options)
+        after = {key for key in keys if data.is_selected(*key)}
+        await data.shared.async_select(entry.entry_id, data.selection)
+        async_dispatcher_send(
+            hass,
+            SIGNAL_PLATFORMS_CHANGED.format(entry.entry_id),
+            after - before,
+            before - after,
+        )
+        return
+    # The shared network outlives the unload, so this does not hydrate again
+    # unless the new options need a network of their own
+    await hass.config_entries.async_reload(entry.entry_id)
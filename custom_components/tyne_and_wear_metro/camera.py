@@ -0,0 +1,75 @@
+"""Camera platform for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from homeassistant.components.camera import Camera
+from homeassistant.helpers.device_registry import DeviceInfo
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from .coordinator import MetroDataUpdateCoordinator
+from .map import MetroMapRenderer
+from .positions import MetroPositionEstimator
+
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
+    from .data import MetroConfigEntry
+
+
+async def async_setup_entry(
+    hass: HomeAssistant,
+    entry: MetroConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+) -> None:
+    coordinator = entry.runtime_data.coordinator
+    network = entry.runtime_data.api
+    renderer = MetroMapRenderer(
+        network, MetroPositionEstimator(network, coordinator.inference)
+    )
+    async_add_entities([MetroMapCamera(renderer, coordinator, entry)])
+
+
+class MetroMapCamera(CoordinatorEntity, Camera):
+    """The network map with every tracked train drawn on it."""
+
+    _attr_has_entity_name = False
+    _attr_name = "Metro map"
+    _attr_icon = "mdi:map"
+    # Trains move between refreshes, so a stream is worth redrawing often
+    _attr_frame_interval = 1
+    coordinator: MetroDataUpdateCoordinator
+
+    def __init__(
+        self,
+        renderer: MetroMapRenderer,
+        coordinator: MetroDataUpdateCoordinator,
+        entry: MetroConfigEntry,
+    ) -> None:
+        super().__init__(coordinator)
+        Camera.__init__(self)
+        self.content_type = "image/png"
+        # The coordinator may be shared with other entries
+        self._attr_unique_id = f"{entry.entry_id}_metro_map"
+        self._attr_device_info = DeviceInfo(
+            name="Tyne and Wear Metro",
+            identifiers={(entry.domain, entry.entry_id)},
+        )
+        self._renderer = renderer
+        # The renderer redraws a single frame in place
+        self._lock = asyncio.Lock()
+
+    async def async_camera_image(
+        self, width: int | None = None, height: int | None = None
+    ) -> bytes | None:
+        glyphs = self._renderer.glyphs()
+        last_update = self.coordinator.data["last_update"] or datetime.now()
+        label = f"Last Updated {last_update:%Y-%m-%d %H:%M}"
+        async with self._lock:
+            return await self.hass.async_add_executor_job(
+                self._renderer.render, glyphs, label
+            )
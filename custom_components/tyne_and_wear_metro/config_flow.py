@@ -4,22 +4,303 @@ from __future__ import annotations
 
 from typing import Any
 
-from homeassistant.config_entries import ConfigFlow, ConfigFlowResult
+import voluptuous as vol
 
-from .const import DOMAIN
+from homeassistant.config_entries import (
+    ConfigEntry,
+    ConfigFlow,
+    ConfigFlowResult,
+    OptionsFlow,
+)
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.selector import (
+    BooleanSelector,
+    EntitySelector,
+    EntitySelectorConfig,
+    NumberSelector,
+    NumberSelectorConfig,
+    NumberSelectorMode,
+    SelectOptionDict,
+    SelectSelector,
+    SelectSelectorConfig,
+    SelectSelectorMode,
+)
+
+from .const import (
+    ATTRIBUTES_COMPACT,
+    ATTRIBUTES_FULL,
+    CONF_APPROACH_DISTANCE,
+    CONF_ATTRIBUTES,
+    CONF_CAPTURE,
+    CONF_END,
+    CONF_HISTORY,
+    CONF_HISTORY_RETENTION,
+    CONF_INFER_ARRIVALS,
+    CONF_LEASE_LENGTH,
+    CONF_LIMIT_PER_HOST,
+    CONF_MAX_IN_FLIGHT,
+    CONF_MAX_TRAINS,
+    CONF_NEAREST_STATION,
+    CONF_PERSONS,
+    CONF_PLATFORMS,
+    CONF_PRESENCE_LEASE_LENGTH,
+    CONF_RECORD_TRAINS,
+    CONF_START,
+    CONF_STATIONS,
+    CONF_TIMEOUT,
+    CONF_TRAIN_TTL,
+    DEFAULT_OPTIONS,
+    DOMAIN,
+)
+from .metro import MetroNetwork
+
+
+async def _async_load_topology(hass: HomeAssistant) -> dict[str, Any]:
+    return await hass.async_add_executor_job(MetroNetwork.load_topology)
+
+
+def _stations_schema(
+    topology: dict[str, Any], default: list[str], journey: dict[str, Any]
+) -> vol.Schema:
+    stations = [
+        SelectOptionDict(value=code, label=name)
+        for code, name in sorted(topology["stations"].items(), key=lambda x: x[1])
+    ]
+    return vol.Schema(
+        {
+            vol.Required(CONF_STATIONS, default=default): SelectSelector(
+                SelectSelectorConfig(
+                    options=stations,
+                    multiple=True,
+                    mode=SelectSelectorMode.DROPDOWN,
+                )
+            ),
+            # A journey sensor is added when both ends are chosen
+            **{
+                vol.Optional(
+                    key, description={"suggested_value": journey.get(key)}
+                ): SelectSelector(
+                    SelectSelectorConfig(
+                        options=stations, mode=SelectSelectorMode.DROPDOWN
+                    )
+                )
+                for key in (CONF_START, CONF_END)
+            },
+        }
+    )
+
+
+def _journey(user_input: dict[str, Any]) -> dict[str, Any]:
+    return {
+        key: user_input[key] for key in (CONF_START, CONF_END) if user_input.get(key)
+    }
+
+
+def _platforms_schema(
+    topology: dict[str, Any], stations: list[str], default: list[str] | None
+) -> vol.Schema:
+    options = [
+        SelectOptionDict(
+            value=f"{code}/{platform['platformNumber']}",
+            label=f"{topology['stations'][code]} platform "
+            f"{platform['platformNumber']} ({platform['helperText']})",
+        )
+        for code in stations
+        for platform in topology["platforms"].get(code, [])
+    ]
+    values = [option["value"] for option in options]
+    # Keep the current choice for stations still selected, and every
+    # platform of any station that has just been added
+    chosen = {value.split("/", 1)[0] for value in default or ()}
+    default = [
+        value
+        for value in values
+        if value in (default or ()) or value.split("/", 1)[0] not in chosen
+    ]
+    return vol.Schema(
+        {
+            vol.Required(CONF_PLATFORMS, default=default): SelectSelector(
+                SelectSelectorConfig(
+                    options=options, multiple=True, mode=SelectSelectorMode.LIST
+                )
+            )
+        }
+    )
+
+
+def _number(minimum: int, maximum: int, unit: str | None = None) -> vol.All:
+    return vol.All(
+        NumberSelector(
+            NumberSelectorConfig(
+                min=minimum,
+                max=maximum,
+                unit_of_measurement=unit,
+                mode=NumberSelectorMode.BOX,
+            )
+        ),
+        vol.Coerce(int),
+    )
+
+
+# Everything but the choice of stations, platforms and journey, in the order
+# the options form shows them
+SETTINGS = {
+    CONF_NEAREST_STATION: BooleanSelector(),
+    CONF_RECORD_TRAINS: BooleanSelector(),
+    CONF_ATTRIBUTES: SelectSelector(
+        SelectSelectorConfig(
+            options=[ATTRIBUTES_FULL, ATTRIBUTES_COMPACT],
+            translation_key=CONF_ATTRIBUTES,
+        )
+    ),
+    CONF_MAX_TRAINS: _number(0, 100),
+    CONF_LEASE_LENGTH: _number(1, 1440, "min"),
+    # Nobody by default, following people's locations is opt in
+    CONF_PERSONS: EntitySelector(EntitySelectorConfig(domain="person", multiple=True)),
+    CONF_PRESENCE_LEASE_LENGTH: _number(1, 120, "min"),
+    CONF_APPROACH_DISTANCE: _number(0, 10000, "m"),
+    CONF_INFER_ARRIVALS: BooleanSelector(),
+    CONF_HISTORY: BooleanSelector(),
+    CONF_HISTORY_RETENTION: _number(1, 3650, "d"),
+    CONF_TRAIN_TTL: _number(1, 120, "min"),
+    CONF_TIMEOUT: _number(1, 120, "s"),
+    CONF_LIMIT_PER_HOST: _number(1, 32),
+    CONF_MAX_IN_FLIGHT: _number(1, 64),
+    CONF_CAPTURE: BooleanSelector(),
+}
+
+
+def _settings_schema(options: dict[str, Any]) -> vol.Schema:
+    return vol.Schema(
+        {
+            vol.Required(key, default=options.get(key, DEFAULT_OPTIONS[key])): selector
+            for key, selector in SETTINGS.items()
+        }
+    )
 
 
 class MetroConfigFlow(ConfigFlow, domain=DOMAIN):
     """Config Flow for Tyne and Wear Metro integration."""
 
-    VERSION = 1
+    VERSION = 2
 
     def __init__(self):
         self._data = {}
+        self._stations: list[str] = []
+        self._journey: dict[str, Any] = {}
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry: ConfigEntry) -> MetroOptionsFlow:
+        return MetroOptionsFlow()
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
     ) -> ConfigFlowResult:
-        if user_input is None:
-            user_input = {}
-        return self.async_create_entry(title="Tyne and Wear Metro", data=self._data)
+        errors = {}
+        if user_input is not None:
+            if user_input[CONF_STATIONS]:
+                self._stations = user_input[CONF_STATIONS]
+                self._journey = _journey(user_input)
+                return await self.async_step_platforms()
+            errors["base"] = "no_stations"
+        topology = await _async_load_topology(self.hass)
+        return self.async_show_form(
+            step_id="user",
+            data_schema=_stations_schema(topology, self._stations, self._journey),
+            errors=errors,
+        )
+
+    async def async_step_platforms(
+        self, user_input: dict[str, Any] | None = None
+    ) -> ConfigFlowResult:
+        errors = {}
+        if user_input is not None:
+            if user_input[CONF_PLATFORMS]:
+                return self.async_create_entry(
+                    title="Tyne and Wear Metro",
+                    data=self._data,
+                    options={
+                        CONF_STATIONS: self._stations,
+                        CONF_PLATFORMS: user_input[CONF_PLATFORMS],
+                        **self._journey,
+                    },
+                )
+            errors["base"] = "no_platforms"
+        topology = await _async_load_topology(self.hass)
+        return self.async_show_form(
+            step_id="platforms",
+            data_schema=_platforms_schema(topology, self._stations, None),
+            errors=errors,
+        )
+
+
+class MetroOptionsFlow(OptionsFlow):
+    """Change which stations and platforms have sensors, then the settings."""
+
+    def __init__(self) -> None:
+        self._stations: list[str] = []
+        self._journey: dict[str, Any] = {}
+        self._options: dict[str, Any] = {}
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> ConfigFlowResult:
+        errors = {}
+        topology = await _async_load_topology(self.hass)
+        if user_input is not None:
+            if user_input[CONF_STATIONS]:
+                self._stations = user_input[CONF_STATIONS]
+                self._journey = _journey(user_input)
+                return await self.async_step_platforms()
+            errors["base"] = "no_stations"
+        return self.async_show_form(
+            step_id="init",
+            data_schema=_stations_schema(
+                topology,
+                self.config_entry.options.get(
+                    CONF_STATIONS, list(topology["stations"])
+                ),
+                self.config_entry.options,
+            ),
+            errors=errors,
+        )
+
+    async def async_step_platforms(
+        self, user_input: dict[str, Any] | None = None
+    ) -> ConfigFlowResult:
+        errors = {}
+        if user_input is not None:
+            if user_input[CONF_PLATFORMS]:
+                options = {
+                    key: value
+                    for key, value in self.config_entry.options.items()
+                    if key not in (CONF_START, CONF_END)
+                }
+                self._options = {
+                    **options,
+                    CONF_STATIONS: self._stations,
+                    CONF_PLATFORMS: user_input[CONF_PLATFORMS],
+                    **self._journey,
+                }
+                return await self.async_step_settings()
+            errors["base"] = "no_platforms"
+        topology = await _async_load_topology(self.hass)
+        return self.async_show_form(
+            step_id="platforms",
+            data_schema=_platforms_schema(
+                topology,
+                self._stations,
+                self.config_entry.options.get(CONF_PLATFORMS),
+            ),
+            errors=errors,
+        )
+
+    async def async_step_settings(
+        self, user_input: dict[str, Any] | None = None
+    ) -> ConfigFlowResult:
+        if user_input is not None:
+            return self.async_create_entry(data={**self._options, **user_input})
+        return self.async_show_form(
+            step_id="settings", data_schema=_settings_schema(self._options)
+        )
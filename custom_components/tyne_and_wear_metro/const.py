@@ -8,3 +8,72 @@ _LOGGER: Logger = getLogger(__package__)
 
 DOMAIN = "tyne_and_wear_metro"
 ATTRIBUTION = "???"
+
+CONF_LIMIT_PER_HOST = "limit_per_host"
+CONF_TIMEOUT = "timeout"
+CONF_MAX_IN_FLIGHT = "max_in_flight"
+CONF_TRAIN_TTL = "train_ttl"
+CONF_INFER_ARRIVALS = "infer_arrivals"
+CONF_HISTORY = "history"
+CONF_HISTORY_RETENTION = "history_retention"
+CONF_ATTRIBUTES = "attributes"
+CONF_MAX_TRAINS = "max_trains"
+CONF_RECORD_TRAINS = "record_trains"
+CONF_CAPTURE = "capture"
+CONF_NEAREST_STATION = "nearest_station"
+CONF_STATIONS = "stations"
+CONF_PLATFORMS = "platforms"
+CONF_START = "start"
+CONF_END = "end"
+CONF_LEASE_LENGTH = "lease_length"
+CONF_PERSONS = "persons"
+CONF_PRESENCE_LEASE_LENGTH = "presence_lease_length"
+CONF_APPROACH_DISTANCE = "approach_distance"
+
+ATTRIBUTES_FULL = "full"
+ATTRIBUTES_COMPACT = "compact"
+
+DEFAULT_LIMIT_PER_HOST = 4
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_TRAIN_TTL = 10
+DEFAULT_INFER_ARRIVALS = False
+DEFAULT_HISTORY = False
+DEFAULT_HISTORY_RETENTION = 30
+DEFAULT_ATTRIBUTES = ATTRIBUTES_FULL
+DEFAULT_MAX_TRAINS = 0
+DEFAULT_RECORD_TRAINS = True
+DEFAULT_CAPTURE = False
+DEFAULT_NEAREST_STATION = True
+DEFAULT_LEASE_LENGTH = 30
+DEFAULT_PRESENCE_LEASE_LENGTH = 10
+DEFAULT_APPROACH_DISTANCE = 500
+
+# What an entry without the option set behaves as, so that entries can be
+# compared whether or not the settings step ever saved them
+DEFAULT_OPTIONS = {
+    CONF_NEAREST_STATION: DEFAULT_NEAREST_STATION,
+    CONF_RECORD_TRAINS: DEFAULT_RECORD_TRAINS,
+    CONF_ATTRIBUTES: DEFAULT_ATTRIBUTES,
+    CONF_MAX_TRAINS: DEFAULT_MAX_TRAINS,
+    CONF_LEASE_LENGTH: DEFAULT_LEASE_LENGTH,
+    CONF_PERSONS: [],
+    CONF_PRESENCE_LEASE_LENGTH: DEFAULT_PRESENCE_LEASE_LENGTH,
+    CONF_APPROACH_DISTANCE: DEFAULT_APPROACH_DISTANCE,
+    CONF_INFER_ARRIVALS: DEFAULT_INFER_ARRIVALS,
+    CONF_HISTORY: DEFAULT_HISTORY,
+    CONF_HISTORY_RETENTION: DEFAULT_HISTORY_RETENTION,
+    CONF_TRAIN_TTL: DEFAULT_TRAIN_TTL,
+    CONF_TIMEOUT: DEFAULT_TIMEOUT,
+    CONF_LIMIT_PER_HOST: DEFAULT_LIMIT_PER_HOST,
+    CONF_MAX_IN_FLIGHT: DEFAULT_MAX_IN_FLIGHT,
+    CONF_CAPTURE: DEFAULT_CAPTURE,
+}
+
+SIGNAL_PLATFORMS_CHANGED = f"{DOMAIN}_platforms_changed_{{}}"
+
+SERVICE_PLAN_JOURNEY = "plan_journey"
+SERVICE_GET_DEPARTURES = "get_departures"
+
+HISTORY_FILE = "tyne_and_wear_metro.db"
+CAPTURE_FILE = "tyne_and_wear_metro_capture.jsonl.gz"
@@ -2,95 +2,430 @@
 
 from __future__ import annotations
 
+import asyncio
 from collections import defaultdict
 from datetime import datetime, timedelta
+import heapq
+import time
 from typing import TYPE_CHECKING, Any
 
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 
-from .const import _LOGGER
-from .metro import MetroNetwork
+from .const import (
+    _LOGGER,
+    ATTRIBUTES_COMPACT,
+    CONF_ATTRIBUTES,
+    CONF_HISTORY,
+    CONF_HISTORY_RETENTION,
+    CONF_INFER_ARRIVALS,
+    CONF_LEASE_LENGTH,
+    CONF_MAX_IN_FLIGHT,
+    CONF_MAX_TRAINS,
+    DEFAULT_ATTRIBUTES,
+    DEFAULT_HISTORY,
+    DEFAULT_HISTORY_RETENTION,
+    DEFAULT_INFER_ARRIVALS,
+    DEFAULT_LEASE_LENGTH,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_MAX_TRAINS,
+    HISTORY_FILE,
+)
+from .history import MetroHistory
+from .inference import MetroInference
+from .leases import MetroLeases
+from .metro import MetroArrival, MetroNetwork
 
 if TYPE_CHECKING:
-    from homeassistant.core import HomeAssistant
+    from collections.abc import Iterable, Mapping
 
-    from .data import MetroConfigEntry
+    from homeassistant.core import HomeAssistant
 
 
 class MetroDataUpdateCoordinator(DataUpdateCoordinator):
     """Class to manage fetching data from the API and updating the sensor."""
 
-    config_entry: MetroConfigEntry
+    MIN_REFRESH = timedelta(seconds=30)
+    IMMINENT_REFRESH = timedelta(seconds=15)
+    MAX_REFRESH = timedelta(minutes=5)
+    MIN_TICK = timedelta(seconds=5)
+    MAX_TICK = timedelta(seconds=45)
+    MAX_BACKOFF = timedelta(minutes=10)
+    # How long the last good departures are served while refreshes fail
+    MAX_STALE = timedelta(minutes=15)
+    # Reuse departure records for trains whose payload has not changed
+    INCREMENTAL = True
 
     def __init__(
         self,
         hass: HomeAssistant,
         name: str,
         api: MetroNetwork,
-        config_entry: MetroConfigEntry,
+        options: Mapping[str, Any],
+        history_path: str | None = None,
     ):
+        # Shared by every config entry with the same options, so it belongs
+        # to none of them
         super().__init__(
             hass,
             _LOGGER,
             name=name,
-            config_entry=config_entry,
+            config_entry=None,
             # update_method=None,
             # update_interval=None,
-            update_interval=timedelta(seconds=45),
+            update_interval=self.MAX_TICK,
             always_update=True,
         )
         self.api = api
+        self._semaphore = asyncio.Semaphore(
+            options.get(CONF_MAX_IN_FLIGHT, DEFAULT_MAX_IN_FLIGHT)
+        )
+        # Scheduled, requested and on demand refreshes take turns
+        self._refresh_lock = asyncio.Lock()
         self.data = {
             "last_update": self.api.last_update,
             "trains": defaultdict(lambda: defaultdict(list)),
             "refreshed": defaultdict(lambda: defaultdict(lambda: None)),
         }
+        # Platforms someone wants refreshed, and until when
+        self.leases = MetroLeases()
+        self.lease_length = timedelta(
+            minutes=options.get(CONF_LEASE_LENGTH, DEFAULT_LEASE_LENGTH)
+        )
+        self.inference = (
+            MetroInference(api)
+            if options.get(CONF_INFER_ARRIVALS, DEFAULT_INFER_ARRIVALS)
+            else None
+        )
+        self.history = (
+            MetroHistory(
+                history_path or hass.config.path(HISTORY_FILE),
+                retention=timedelta(
+                    days=options.get(CONF_HISTORY_RETENTION, DEFAULT_HISTORY_RETENTION)
+                ),
+            )
+            if options.get(CONF_HISTORY, DEFAULT_HISTORY)
+            else None
+        )
+        # Heap of (due, station_code, platform_code), stale entries are
+        # skipped by checking them against _due on the way out
+        self._schedule: list[tuple[datetime, str, str]] = []
+        self._due: dict[tuple[str, str], datetime] = {}
+        # Platforms whose departures changed in the last refresh, so that
+        # sensors for the others can skip writing an identical state
+        self.changed: set[tuple[str, str]] = set()
+        self._fingerprints: dict[tuple[str, str], tuple] = {}
+        # Consecutive failed refreshes, by platform
+        self._failures: dict[tuple[str, str], int] = {}
+        # Estimated arrivals by unpolled platform and trn
+        self._estimates: dict[tuple[str, str], dict[str, dict[str, Any]]] = {}
+        # Departure records by platform and trn, with the train revision and
+        # arrival they were built from
+        self._records: dict[
+            tuple[str, str], dict[str, tuple[int, MetroArrival, dict[str, Any]]]
+        ] = {}
+        self.records_built, self.records_reused = 0, 0
+        self.state_writes, self.state_writes_skipped = 0, 0
+        self.compact = (
+            options.get(CONF_ATTRIBUTES, DEFAULT_ATTRIBUTES) == ATTRIBUTES_COMPACT
+        )
+        self.max_trains = options.get(CONF_MAX_TRAINS, DEFAULT_MAX_TRAINS)
+        self._attributes: dict[tuple[str, str], list[dict[str, Any]]] = {}
+        # Departures as answered by the get_departures action, built once per
+        # change like the sensor attributes
+        self._departures: dict[tuple[str, str], list[dict[str, Any]]] = {}
+        self.departures_built, self.departures_reused = 0, 0
+        self._last_tick_writes = (0, 0)
+
+    def subscribe(
+        self,
+        station_code: str,
+        platform_code: str,
+        length: timedelta | None = None,
+    ) -> None:
+        """Keep a platform refreshing for length, or lease_length, from now."""
+        now = datetime.now()
+        self.leases.grant(
+            station_code, platform_code, now + (length or self.lease_length)
+        )
+        refreshed = self.data["refreshed"][station_code][platform_code]
+        due = now if refreshed is None else max(now, refreshed + self.MIN_REFRESH)
+        self._reschedule(station_code, platform_code, due, earlier_only=True)
+
+    def unsubscribe(self, station_code: str, platform_code: str) -> None:
+        """Stop refreshing a platform that is no longer wanted, and forget it."""
+        key = (station_code, platform_code)
+        self.leases.revoke(station_code, platform_code)
+        # Its heap entry no longer matches _due, so it is skipped when popped
+        self._due.pop(key, None)
+        self._fingerprints.pop(key, None)
+        self._failures.pop(key, None)
+        self._estimates.pop(key, None)
+        self._records.pop(key, None)
+        self._attributes.pop(key, None)
+        self._departures.pop(key, None)
+        self.data["trains"][station_code].pop(platform_code, None)
+        self.data["refreshed"][station_code].pop(platform_code, None)
+
+    def _reschedule(
+        self,
+        station_code: str,
+        platform_code: str,
+        due: datetime,
+        earlier_only: bool = False,
+    ) -> None:
+        key = (station_code, platform_code)
+        if earlier_only and key in self._due and self._due[key] <= due:
+            return
+        self._due[key] = due
+        heapq.heappush(self._schedule, (due, station_code, platform_code))
+
+    def _pop_due(self, now: datetime) -> list[tuple[str, str]]:
+        due = []
+        while self._schedule and self._schedule[0][0] <= now:
+            when, station_code, platform_code = heapq.heappop(self._schedule)
+            key = (station_code, platform_code)
+            if self._due.get(key) == when:
+                del self._due[key]
+                due.append(key)
+        return due
+
+    def next_refresh(self, trains: list[dict[str, Any]]) -> timedelta:
+        """Work out how long a platform can wait before refreshing again."""
+        if not trains:
+            return self.MAX_REFRESH
+        train = trains[0]
+        if train["due_in"] <= 2 or train["last_event"] == "APPROACHING":
+            return self.IMMINENT_REFRESH
+        return min(
+            max(timedelta(seconds=train["due_in"] * 15), self.MIN_REFRESH),
+            self.MAX_REFRESH,
+        )
+
+    def _set_trains(
+        self,
+        data: dict,
+        station_code: str,
+        platform_code: str,
+        trains: list[dict[str, Any]],
+    ) -> None:
+        data["trains"][station_code][platform_code] = trains
+        fingerprint = tuple(
+            (
+                train["trn"],
+                train["due_in"],
+                train["due_time"],
+                train["destination_code"],
+                train["last_event"],
+                train["last_event_location"],
+            )
+            for train in trains
+        )
+        key = (station_code, platform_code)
+        if self._fingerprints.get(key, ()) != fingerprint:
+            self._fingerprints[key] = fingerprint
+            self._attributes.pop(key, None)
+            self._departures.pop(key, None)
+            self.changed.add(key)
+
+    async def async_ensure_fresh(
+        self, platforms: Iterable[tuple[str, str]], max_age: timedelta | None
+    ) -> None:
+        """Refresh any of these platforms with no departures or older ones.
+
+        Never refreshes a platform more often than IMMINENT_REFRESH, however
+        small max_age is.
+        """
+        now = datetime.now()
+        max_age = None if max_age is None else max(max_age, self.IMMINENT_REFRESH)
+        refresh = False
+        for station_code, platform_code in platforms:
+            self.subscribe(station_code, platform_code)
+            age = self.age(station_code, platform_code)
+            if age is None or (max_age is not None and age > max_age):
+                self._reschedule(station_code, platform_code, now)
+                refresh = True
+        if refresh:
+            await self.async_refresh()
+
+    def has_changed(self, station_code: str, platform_code: str) -> bool:
+        return (station_code, platform_code) in self.changed
+
+    def backoff(self, failures: int) -> timedelta:
+        return min(self.MIN_REFRESH * 2 ** (failures - 1), self.MAX_BACKOFF)
+
+    def age(self, station_code: str, platform_code: str) -> timedelta | None:
+        """How old the departures served for a platform are."""
+        refreshed = self.data["refreshed"][station_code][platform_code]
+        return None if refreshed is None else datetime.now() - refreshed
+
+    def is_stale(self, station_code: str, platform_code: str) -> bool:
+        return (station_code, platform_code) in self._failures
+
+    def is_expired(self, station_code: str, platform_code: str) -> bool:
+        """Whether a failing platform has outlived MAX_STALE."""
+        if not self.is_stale(station_code, platform_code):
+            return False
+        age = self.age(station_code, platform_code)
+        return age is None or age > self.MAX_STALE
 
     async def _async_setup(self) -> None:
         await self.api.hydrate()
 
     async def _async_update_data(self) -> Any:
+        async with self._refresh_lock:
+            return await self._async_update()
+
+    async def _async_update(self) -> Any:
         data = self.data or {}
+        _LOGGER.debug(
+            "Last refresh wrote %s platform states and avoided %s",
+            self.state_writes - self._last_tick_writes[0],
+            self.state_writes_skipped - self._last_tick_writes[1],
+        )
+        self._last_tick_writes = (self.state_writes, self.state_writes_skipped)
+        self.changed = set()
+        start = time.perf_counter()
         try:
-            subscription_cutoff = datetime.now() - timedelta(minutes=30)
-            refresh_cutoff = datetime.now() - timedelta(seconds=30)
-            # _LOGGER.warning(f"{self.api.last_update} Starting refresh")
-            for platform_sensor in self.async_contexts():
-                station_code, platform_code, subscribed_time = (
-                    platform_sensor.refresh_params()
-                )
-                if subscribed_time is None or subscribed_time < subscription_cutoff:
-                    data["trains"][station_code][platform_code] = []
-                    data["refreshed"][station_code][platform_code] = None
-                elif (
-                    data["refreshed"][station_code][platform_code] is None
-                    or data["refreshed"][station_code][platform_code] < refresh_cutoff
-                ):
-                    # _LOGGER.warning(
-                    #     f"{self.api.last_update} Refreshing {station_code} platform {platform_code}"
-                    # )
-                    await self.api.update(station_code, platform_code)
-                    trains = [
-                        train.as_dict(station_code, platform_code)
-                        for train in self.api.list_trains(station_code, platform_code)
-                    ]
-                    # _LOGGER.warning(
-                    #     f"{self.api.last_update} Got {len(trains)} for {station_code} platform {platform_code}"
-                    # )
-                    data["trains"][station_code][platform_code] = trains
-                    data["refreshed"][station_code][platform_code] = (
-                        self.api.last_update
+            now = datetime.now()
+            for station_code, platform_code in self.leases.expire(now):
+                key = (station_code, platform_code)
+                self._due.pop(key, None)
+                self._failures.pop(key, None)
+                self._records.pop(key, None)
+                self._set_trains(data, station_code, platform_code, [])
+                data["refreshed"][station_code][platform_code] = None
+            due = [key for key in self._pop_due(now) if key in self.leases]
+            results = await asyncio.gather(
+                *(
+                    self._async_refresh_platform(station_code, platform_code)
+                    for station_code, platform_code in due
+                ),
+                return_exceptions=True,
+            )
+            failed = 0
+            for (station_code, platform_code), result in zip(due, results, strict=True):
+                if not self.api.is_selected(station_code, platform_code):
+                    # Deselected while it was being refreshed
+                    continue
+                key = (station_code, platform_code)
+                if isinstance(result, BaseException):
+                    # Keep serving the last good departures, retrying later
+                    # and later while the platform keeps failing
+                    failed += 1
+                    failures = self._failures[key] = self._failures.get(key, 0) + 1
+                    self._reschedule(
+                        station_code, platform_code, now + self.backoff(failures)
+                    )
+                    # So that sensors write their staleness
+                    self.changed.add(key)
+                    _LOGGER.debug(
+                        "Error refreshing %s platform %s, attempt %s: %s",
+                        station_code,
+                        platform_code,
+                        failures,
+                        result,
+                    )
+                    continue
+                if self._failures.pop(key, None) is not None:
+                    self.changed.add(key)
+                trains, refreshed = result
+                self._set_trains(data, station_code, platform_code, trains)
+                data["refreshed"][station_code][platform_code] = refreshed
+                if self.history is not None:
+                    self.history.record(
+                        station_code,
+                        platform_code,
+                        list(self.api.list_trains(station_code, platform_code)),
+                        refreshed,
                     )
-                # else:
-                #     _LOGGER.warning(
-                #         f"{self.api.last_update} Nothing to do for {station_code} platform {platform_code}"
-                #     )
+                self._reschedule(
+                    station_code, platform_code, refreshed + self.next_refresh(trains)
+                )
+            if evicted := self.api.evict_trains():
+                _LOGGER.debug("Evicted %s trains from the registry", evicted)
+            if self.inference is not None:
+                self._infer_arrivals(data, due)
+            if self.history is not None and self.history.needs_flush:
+                self.hass.async_create_background_task(
+                    self.history.async_flush(), "metro history flush"
+                )
             data["last_update"] = self.api.last_update
-            # _LOGGER.warning(f"{self.api.last_update} Refresh finished")
+            self.api.api.metrics.record_refresh(
+                time.perf_counter() - start,
+                refreshed=len(due) - failed,
+                failed=failed,
+                skipped=len(self.leases) - len(due),
+                trains=len(self.api.trains),
+            )
+            self.update_interval = (
+                min(
+                    max(self._schedule[0][0] - datetime.now(), self.MIN_TICK),
+                    self.MAX_TICK,
+                )
+                if self._schedule
+                else self.MAX_TICK
+            )
         except Exception as e:  # noqa: BLE001
             raise UpdateFailed(f"Error updating MetroDataUpdateCoordinator: {e}")
         return data
 
+    def _infer_arrivals(self, data: dict, refreshed: list[tuple[str, str]]) -> None:
+        """Learn from the platforms just polled and estimate all the others.
+
+        Trains only change when a platform reporting them is polled, so only
+        those are estimated again, the rest keep their earlier estimates.
+        """
+        observed = set()
+        for station_code, platform_code in refreshed:
+            observed.update(self.api.list_trains(station_code, platform_code))
+        for train in observed:
+            self.inference.observe(train)
+        for platform in self.api.list_platforms():
+            key = (platform.station.station_code, platform.platform_code)
+            if key in self.leases:
+                self._estimates.pop(key, None)
+                continue
+            if (estimates := self._estimates.get(key)) is None:
+                # Never estimated, or polled until now, so start from scratch
+                estimates = self._estimates[key] = {}
+                trains = self.api.trains.values()
+            else:
+                trains = observed
+            self._set_trains(
+                data, *key, self.inference.update(platform, estimates, trains)
+            )
+
+    async def _async_refresh_platform(
+        self, station_code: str, platform_code: str
+    ) -> tuple[list[dict[str, Any]], datetime]:
+        async with self._semaphore:
+            await self.api.update(station_code, platform_code)
+        platform = self.api.stations[station_code].platforms[platform_code]
+        key = (station_code, platform_code)
+        previous = self._records.get(key, {}) if self.INCREMENTAL else {}
+        records = {}
+        trains = []
+        for train in platform.list_trains():
+            # Other platforms refreshing meanwhile may have moved its focus
+            was = train.focus(station_code, platform_code)
+            arrival = train.arrival
+            train.focus(*was)
+            cached = previous.get(train.trn)
+            if (
+                cached is not None
+                and cached[0] == train.revision
+                and cached[1] is arrival
+            ):
+                record = cached[2]
+                self.records_reused += 1
+            else:
+                record = train.as_dict(station_code, platform_code)
+                self.records_built += 1
+            records[train.trn] = (train.revision, arrival, record)
+            trains.append(record)
+        self._records[key] = records
+        return trains, platform.last_update
+
     def next_train(self, station_code: str, platform_code: str) -> str:
         try:
             train = self.data["trains"][station_code][platform_code][0]
@@ -98,8 +433,64 @@ class MetroDataUpdateCoordinator(DataUpdateCoordinator):
         except (IndexError, KeyError) as e:  # noqa: F841
             return "Unknown"
 
+    def train_attributes(
+        self, station_code: str, platform_code: str
+    ) -> list[dict[str, Any]]:
+        """Trains as published on the sensor, built once per change."""
+        key = (station_code, platform_code)
+        if (attributes := self._attributes.get(key)) is not None:
+            return attributes
+        trains = self.trains(station_code, platform_code)
+        if self.max_trains:
+            trains = trains[: self.max_trains]
+        if self.compact:
+            trains = [
+                {
+                    "trn": train["trn"],
+                    "line": train["line"],
+                    "destination": train["destination_name"],
+                    "due_in": train["due_in"],
+                    "due_time": train["due_time"].isoformat()
+                    if train["due_time"]
+                    else None,
+                }
+                for train in trains
+            ]
+        self._attributes[key] = trains
+        return trains
+
+    def departures(self, station_code: str, platform_code: str) -> list[dict[str, Any]]:
+        """Trains as answered by the get_departures action, built once per change."""
+        key = (station_code, platform_code)
+        if (departures := self._departures.get(key)) is not None:
+            self.departures_reused += 1
+            return departures
+        departures = [
+            {
+                "trn": train["trn"],
+                "line": train["line"],
+                "platform": platform_code,
+                "destination": train["destination_name"],
+                "destination_code": train["destination_code"],
+                "due_in": train["due_in"],
+                "due_time": _isoformat(train["due_time"]),
+                "scheduled_time": _isoformat(train["scheduled_time"]),
+                "last_event": train["last_event"],
+                "last_event_location": train["last_event_location"],
+                "last_event_time": _isoformat(train["last_event_time"]),
+            }
+            for train in self.trains(station_code, platform_code)
+        ]
+        self._departures[key] = departures
+        self.departures_built += 1
+        return departures
+
     def trains(self, station_code: str, platform_code: str) -> list[dict[str, str]]:
         try:
             return self.data["trains"][station_code][platform_code]
         except (IndexError, KeyError) as e:  # noqa: F841
             return []
+
+
+def _isoformat(value: datetime | None) -> str | None:
+    return None if value is None else value.isoformat()
@@ -2,15 +2,20 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import TYPE_CHECKING
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
 
 from homeassistant.config_entries import ConfigEntry
 
+from .const import CONF_PLATFORMS
 from .coordinator import MetroDataUpdateCoordinator
 
 if TYPE_CHECKING:
     from .metro import MetroNetwork
+    from .planner import MetroJourneyPlanner
+    from .presence import MetroPresence
+    from .shared import MetroShared
 
 type MetroConfigEntry = ConfigEntry[MetroData]
 
@@ -21,3 +26,25 @@ class MetroData:
 
     api: MetroNetwork
     coordinator: MetroDataUpdateCoordinator
+    planner: MetroJourneyPlanner
+    # The network, coordinator and planner are shared with other entries
+    shared: MetroShared
+    presence: MetroPresence | None = None
+    # Options the entry was set up with, to tell what a change touched
+    options: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def selection(self) -> set[tuple[str, str]] | None:
+        return selected_platforms(self.options)
+
+    def is_selected(self, station_code: str, platform_code: str) -> bool:
+        """Whether this entry chose a platform, whatever others share."""
+        selection = self.selection
+        return selection is None or (station_code, platform_code) in selection
+
+
+def selected_platforms(options: Mapping[str, Any]) -> set[tuple[str, str]] | None:
+    """Chosen (station_code, platform_code) pairs, None for every platform."""
+    if (platforms := options.get(CONF_PLATFORMS)) is None:
+        return None
+    return {tuple(platform.split("/", 1)) for platform in platforms}
@@ -0,0 +1,66 @@
+"""Diagnostics support for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+from .const import DOMAIN
+from .positions import MetroPositionEstimator
+
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
+    from .data import MetroConfigEntry
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: MetroConfigEntry
+) -> dict[str, Any]:
+    network = entry.runtime_data.api
+    coordinator = entry.runtime_data.coordinator
+    api = network.api
+    networks = hass.data[DOMAIN]
+    return {
+        "options": dict(entry.options),
+        "shared": {
+            "entries": len(entry.runtime_data.shared.selections),
+            "networks": len(networks.shared),
+            "created": networks.created,
+            "reused": networks.reused,
+        },
+        "topology_version": network.topology_version,
+        "metrics": api.metrics.as_dict(),
+        "breaker": {
+            "open": api.breaker_open,
+            "failures": api.failures,
+        },
+        "cache": {
+            "entries": len(api._cache),  # noqa: SLF001
+            "hits": api.cache_hits,
+            "misses": api.cache_misses,
+            "coalesced": api.coalesced,
+        },
+        "coordinator": {
+            "leases": len(coordinator.leases),
+            "leases_granted": coordinator.leases.granted,
+            "leases_expired": coordinator.leases.expired,
+            "scheduled": len(coordinator._due),  # noqa: SLF001
+            "failing": len(coordinator._failures),  # noqa: SLF001
+            "update_interval": coordinator.update_interval,
+            "state_writes": coordinator.state_writes,
+            "state_writes_skipped": coordinator.state_writes_skipped,
+            "records_built": coordinator.records_built,
+            "records_reused": coordinator.records_reused,
+            "departures_built": coordinator.departures_built,
+            "departures_reused": coordinator.departures_reused,
+        },
+        "presence": None
+        if (presence := entry.runtime_data.presence) is None
+        else {"arrivals": presence.arrivals, "renewals": presence.renewals},
+        "history": None
+        if coordinator.history is None
+        else {"rows_written": coordinator.history.rows_written},
+        "positions": MetroPositionEstimator(network, coordinator.inference)
+        .estimate()
+        .as_dict(),
+    }
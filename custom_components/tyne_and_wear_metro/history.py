@@ -0,0 +1,125 @@
+"""Local store of observed arrivals for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta
+import sqlite3
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .metro import MetroTrain
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS arrivals (
+    trn TEXT NOT NULL,
+    station TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    due_time TEXT,
+    scheduled_time TEXT,
+    last_event TEXT,
+    last_event_location TEXT,
+    observed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS arrivals_platform
+    ON arrivals (station, platform, observed_at);
+CREATE INDEX IF NOT EXISTS arrivals_trn ON arrivals (trn, observed_at);
+"""
+
+type ArrivalRow = tuple[str, str, str, str | None, str | None, str, str, str]
+
+
+class MetroHistory:
+    """Buffer observed arrivals and write them to SQLite in batches.
+
+    Rows are queued on the event loop and written by a single executor job,
+    so a refresh only pays for appending to a list.
+    """
+
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = timedelta(minutes=1)
+    RETENTION = timedelta(days=30)
+
+    def __init__(self, path: str, retention: timedelta = RETENTION) -> None:
+        self.path, self.retention = path, retention
+        self._pending: list[ArrivalRow] = []
+        self._connection: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+        self._last_flush = datetime.now()
+        self.rows_written = 0
+
+    def record(
+        self,
+        station_code: str,
+        platform_code: str,
+        trains: list[MetroTrain],
+        observed_at: datetime,
+    ) -> None:
+        observed = observed_at.isoformat()
+        for train in trains:
+            was_station, was_platform = train.focus(station_code, platform_code)
+            arrival = train.arrival
+            self._pending.append(
+                (
+                    train.trn,
+                    station_code,
+                    platform_code,
+                    arrival.due_time.isoformat() if arrival.due_time else None,
+                    arrival.scheduled_time.isoformat()
+                    if arrival.scheduled_time
+                    else None,
+                    train.last_event,
+                    train.last_event_location,
+                    observed,
+                )
+            )
+            train.focus(was_station, was_platform)
+
+    @property
+    def needs_flush(self) -> bool:
+        return len(self._pending) >= self.BATCH_SIZE or (
+            bool(self._pending)
+            and datetime.now() - self._last_flush >= self.FLUSH_INTERVAL
+        )
+
+    async def async_flush(self) -> None:
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        self._last_flush = datetime.now()
+        async with self._lock:
+            await asyncio.to_thread(self._write, rows)
+        self.rows_written += len(rows)
+
+    async def async_purge(self) -> None:
+        """Delete rows older than the retention period and compact the file."""
+        cutoff = (datetime.now() - self.retention).isoformat()
+        async with self._lock:
+            await asyncio.to_thread(self._purge, cutoff)
+
+    async def async_close(self) -> None:
+        await self.async_flush()
+        async with self._lock:
+            if self._connection is not None:
+                await asyncio.to_thread(self._connection.close)
+                self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _write(self, rows: list[ArrivalRow]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO arrivals VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def _purge(self, cutoff: str) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM arrivals WHERE observed_at < ?", (cutoff,))
+        connection.execute("VACUUM")
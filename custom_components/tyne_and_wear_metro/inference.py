@@ -0,0 +1,155 @@
+"""Arrival estimates for platforms that are not being polled."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from itertools import pairwise
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from .metro import MetroNetwork, MetroPlatform, MetroTrain
+
+
+class MetroInference:
+    """Estimate arrivals from trains seen elsewhere on the same line.
+
+    Run times between neighbouring stations are learned from the predicted
+    times of trains that are reported at more than one polled platform.
+    """
+
+    DEFAULT_RUN_TIME = 120.0
+    SMOOTHING = 0.2
+    HORIZON = timedelta(minutes=60)
+
+    def __init__(self, network: MetroNetwork) -> None:
+        self.network = network
+        # Seconds from one station to the next, keyed by direction of travel
+        self.run_times: dict[tuple[str, str], float] = {}
+
+    def route(self, train: MetroTrain) -> list[str]:
+        return self.network.routes.get(train.line.upper(), [])
+
+    def run_time(self, route: list[str], start: int, end: int) -> float:
+        step = 1 if end >= start else -1
+        return sum(
+            self.run_times.get((route[i], route[i + step]), self.DEFAULT_RUN_TIME)
+            for i in range(start, end, step)
+        )
+
+    def observe(self, train: MetroTrain) -> None:
+        """Learn run times from the predicted arrivals of one train."""
+        route = self.route(train)
+        seen = sorted(
+            (arrival.due_time, route.index(station_code))
+            for (station_code, _), arrival in train.list_arrivals()
+            if arrival.due_time is not None and station_code in route
+        )
+        for (from_time, start), (to_time, end) in pairwise(seen):
+            if start == end or to_time <= from_time:
+                continue
+            step = 1 if end > start else -1
+            per_stop = (to_time - from_time).total_seconds() / abs(end - start)
+            for i in range(start, end, step):
+                segment = (route[i], route[i + step])
+                learned = self.run_times.get(segment, self.DEFAULT_RUN_TIME)
+                self.run_times[segment] = learned + self.SMOOTHING * (
+                    per_stop - learned
+                )
+
+    def estimate(
+        self,
+        platform: MetroPlatform,
+        now: datetime | None = None,
+        trains: Iterable[MetroTrain] | None = None,
+    ) -> list[dict[str, Any]]:
+        """Estimate the trains, or all of them, due at a platform, soonest first."""
+        station_code = platform.station.station_code
+        estimates = []
+        for train in self.network.trains.values() if trains is None else trains:
+            if (
+                due_time := self._estimate_train(train, station_code, platform)
+            ) is None:
+                continue
+            now = now or datetime.now(due_time.tzinfo)
+            if not timedelta(0) <= due_time - now <= self.HORIZON:
+                continue
+            estimates.append(
+                {
+                    "trn": train.trn,
+                    "line": train.line,
+                    "destination_name": train.destination.station_name,
+                    "destination_code": train.destination.station_code,
+                    "last_event": train.last_event,
+                    "last_event_location": train.last_event_location,
+                    "last_event_time": train.last_event_time,
+                    "due_in": int((due_time - now).total_seconds() // 60),
+                    "due_time": due_time,
+                    "scheduled_time": None,
+                    "inferred": True,
+                }
+            )
+        estimates.sort(key=lambda x: x["due_time"])
+        return estimates
+
+    def update(
+        self,
+        platform: MetroPlatform,
+        estimates: dict[str, dict[str, Any]],
+        trains: Iterable[MetroTrain],
+        now: datetime | None = None,
+    ) -> list[dict[str, Any]]:
+        """Re-estimate some trains at a platform and keep the rest, soonest first.
+
+        estimates holds the earlier estimates by trn and is updated in place.
+        The others only have their due_in brought up to date, or are dropped
+        once due or gone from the network.
+        """
+        trains = list(trains)
+        for train in trains:
+            estimates.pop(train.trn, None)
+        for estimate in self.estimate(platform, now, trains):
+            estimates[estimate["trn"]] = estimate
+        for trn, estimate in list(estimates.items()):
+            current = now or datetime.now(estimate["due_time"].tzinfo)
+            if trn not in self.network.trains or estimate["due_time"] < current:
+                del estimates[trn]
+                continue
+            due_in = int((estimate["due_time"] - current).total_seconds() // 60)
+            if due_in != estimate["due_in"]:
+                estimates[trn] = {**estimate, "due_in": due_in}
+        return sorted(estimates.values(), key=lambda x: x["due_time"])
+
+    def _estimate_train(
+        self, train: MetroTrain, station_code: str, platform: MetroPlatform
+    ) -> datetime | None:
+        route = self.route(train)
+        # The last reported platform need not be hydrated, so go by topology
+        last = self.network.locate(train.last_event_location)
+        if (
+            train.last_event_time is None
+            or last is None
+            or self.network.platform_data[last].get("direction") != platform.direction
+            or station_code not in route
+            or last[0] not in route
+        ):
+            return None
+        step = 1 if platform.direction == "IN" else -1
+        target = route.index(station_code)
+        position = route.index(last[0])
+        if train.destination.station_code in route:
+            terminus = route.index(train.destination.station_code)
+        else:
+            terminus = len(route) - 1 if step > 0 else 0
+        if not (position * step < target * step <= terminus * step):
+            return None
+        # Start from the latest reported arrival before the target, if any
+        base_time, base = train.last_event_time, position
+        for (arrival_station, _), arrival in train.list_arrivals():
+            if arrival.due_time is None or arrival_station not in route:
+                continue
+            index = route.index(arrival_station)
+            if base * step < index * step <= target * step:
+                base_time, base = arrival.due_time, index
+        return base_time + timedelta(seconds=self.run_time(route, base, target))
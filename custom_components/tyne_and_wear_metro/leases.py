@@ -0,0 +1,62 @@
+"""Subscription leases for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+from datetime import datetime
+import heapq
+
+
+class MetroLeases:
+    """How long each platform is wanted for, expiring off a heap.
+
+    A platform stays leased until the latest expiry granted for it. A tick
+    only pops the leases that have run out, rather than passing over every
+    platform. Extending a lease leaves its old heap entry behind, and that
+    entry is skipped when it comes up.
+    """
+
+    def __init__(self) -> None:
+        self._expires: dict[tuple[str, str], datetime] = {}
+        self._heap: list[tuple[datetime, str, str]] = []
+        self.granted, self.expired = 0, 0
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        """Whether a station and platform code pair is leased."""
+        return key in self._expires
+
+    def __len__(self) -> int:
+        """Count the leased platforms."""
+        return len(self._expires)
+
+    def expires(self, station_code: str, platform_code: str) -> datetime | None:
+        return self._expires.get((station_code, platform_code))
+
+    def grant(self, station_code: str, platform_code: str, until: datetime) -> bool:
+        """Lease a platform until then, returning whether it was newly leased."""
+        key = (station_code, platform_code)
+        current = self._expires.get(key)
+        self.granted += 1
+        if current is not None and current >= until:
+            return False
+        self._expires[key] = until
+        heapq.heappush(self._heap, (until, station_code, platform_code))
+        # Leases renewed over and over leave a trail of old entries
+        if len(self._heap) > 2 * len(self._expires) + 16:
+            self._heap = [(expires, *lease) for lease, expires in self._expires.items()]
+            heapq.heapify(self._heap)
+        return current is None
+
+    def revoke(self, station_code: str, platform_code: str) -> None:
+        self._expires.pop((station_code, platform_code), None)
+
+    def expire(self, now: datetime) -> list[tuple[str, str]]:
+        """Remove and return the leases that have run out by now."""
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            until, station_code, platform_code = heapq.heappop(self._heap)
+            key = (station_code, platform_code)
+            if self._expires.get(key) == until:
+                del self._expires[key]
+                expired.append(key)
+        self.expired += len(expired)
+        return expired
@@ -0,0 +1,211 @@
+"""Network map rendering for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+from collections import OrderedDict, defaultdict
+import io
+from typing import TYPE_CHECKING
+
+from PIL import Image, ImageDraw
+
+if TYPE_CHECKING:
+    from .metro import MetroNetwork
+    from .positions import MetroPositionEstimator
+
+# x, y, d(irection) and colour of a train on the map
+type Glyph = tuple[int, int, str, str]
+type Box = tuple[int, int, int, int]
+
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+class MetroMapRenderer:
+    """Draw trains over a base map of the network.
+
+    The base map is drawn once from the topology, after that only the regions
+    around trains that moved are restored and redrawn. Trains are drawn where
+    the estimator puts them between stations. Encoded frames are kept
+    in a small cache keyed by what is on them, so an unchanged network costs a
+    dictionary lookup.
+    """
+
+    MARGIN = 60
+    FRAME_CACHE = 8
+    COMPRESS_LEVEL = 1
+    BACKGROUND = "white"
+    LINE_COLOURS = {"GREEN": "#6cb33f", "YELLOW": "#f4c300"}
+    TRAIN_COLOURS = {"GREEN": "#2e6b14", "YELLOW": "#b35c00"}
+    LABEL_POSITION = (200, 400)
+    # Tail, head, two barbs and the label offset of the arrow for a direction
+    ARROWS = {
+        "N": [(0, 10), (0, -10), (-5, -5), (5, -5), (-24, 0)],
+        "S": [(0, -10), (0, 10), (-5, 5), (5, 5), (8, 0)],
+        "E": [(-10, 0), (10, 0), (5, 5), (5, -5), (-16, -12)],
+        "W": [(10, 0), (-10, 0), (-5, 5), (-5, -5), (0, 5)],
+        "U": [(5, 8), (-6, -9), (-6, -1), (0, -5), (-8, 8)],
+        "D": [(-6, -9), (5, 8), (6, 1), (0, 5), (8, 8)],
+    }
+
+    def __init__(
+        self, network: MetroNetwork, estimator: MetroPositionEstimator
+    ) -> None:
+        self.network, self.estimator = network, estimator
+        self._base: Image.Image | None = None
+        self._frame: Image.Image | None = None
+        self._drawn: dict[str, tuple[Glyph, Box]] = {}
+        self._label: tuple[str, Box] | None = None
+        self._frames: OrderedDict[tuple, bytes] = OrderedDict()
+        self._topology: str | None = None
+        self.renders, self.frame_hits, self.regions_redrawn = 0, 0, 0
+
+    def glyphs(self) -> dict[str, Glyph]:
+        """Where each known train should be drawn, read on the event loop."""
+        estimate = self.estimator.estimate()
+        return {
+            trn: (
+                round(float(x)),
+                round(float(y)),
+                direction,
+                self.TRAIN_COLOURS.get(line, "red"),
+            )
+            for trn, line, direction, (x, y, _, _) in zip(
+                estimate.trns,
+                estimate.lines,
+                estimate.arrows,
+                estimate.positions,
+                strict=True,
+            )
+            if direction in self.ARROWS
+        }
+
+    def render(self, glyphs: dict[str, Glyph], label: str) -> bytes:
+        """Encode a PNG of the map with these trains, blocking."""
+        key = (frozenset(glyphs.items()), label)
+        if (frame := self._frames.get(key)) is not None:
+            self._frames.move_to_end(key)
+            self.frame_hits += 1
+            return frame
+        if self._base is None or self._topology != self.network.topology_fingerprint:
+            self._topology = self.network.topology_fingerprint
+            self._base = self._draw_base()
+            self._frame = self._base.copy()
+            self._drawn, self._label = {}, None
+            self._frames.clear()
+        draw = ImageDraw.Draw(self._frame)
+
+        dirty: list[Box] = [
+            box for trn, (glyph, box) in self._drawn.items() if glyphs.get(trn) != glyph
+        ]
+        boxes: dict[str | None, Box] = {}
+        for trn, glyph in glyphs.items():
+            if (drawn := self._drawn.get(trn)) is not None and drawn[0] == glyph:
+                boxes[trn] = drawn[1]
+            else:
+                boxes[trn] = self._glyph_box(draw, trn, glyph)
+                dirty.append(boxes[trn])
+        if self._label is None or self._label[0] != label:
+            if self._label is not None:
+                dirty.append(self._label[1])
+            self._label = (
+                label,
+                self._clamp(draw.textbbox(self.LABEL_POSITION, label)),
+            )
+            dirty.append(self._label[1])
+
+        # Anything overlapping a restored region has to be restored and
+        # redrawn whole too, or it would be clipped or drawn over itself
+        boxes[None] = self._label[1]
+        redraw: set[str | None] = set()
+        while True:
+            touching = {
+                item
+                for item, box in boxes.items()
+                if item not in redraw
+                and any(_intersects(box, region) for region in dirty)
+            }
+            if not touching:
+                break
+            redraw |= touching
+            dirty.extend(boxes[item] for item in touching)
+        dirty = [box for box in dirty if box[0] < box[2] and box[1] < box[3]]
+        for box in dirty:
+            self._frame.paste(self._base.crop(box), box[:2])
+        for trn, glyph in glyphs.items():
+            if trn in redraw:
+                self._draw_glyph(draw, trn, glyph)
+        if None in redraw:
+            draw.text(self.LABEL_POSITION, label, fill="black")
+        self._drawn = {trn: (glyph, boxes[trn]) for trn, glyph in glyphs.items()}
+        self.regions_redrawn += len(dirty)
+        self.renders += 1
+
+        buffer = io.BytesIO()
+        self._frame.save(buffer, "PNG", compress_level=self.COMPRESS_LEVEL)
+        frame = buffer.getvalue()
+        self._frames[key] = frame
+        while len(self._frames) > self.FRAME_CACHE:
+            self._frames.popitem(last=False)
+        return frame
+
+    def _draw_base(self) -> Image.Image:
+        points: defaultdict[str, list[tuple[float, float]]] = defaultdict(list)
+        for (station_code, _), platform in self.network.platform_data.items():
+            coordinates = platform.get("coordinates", {})
+            if "x" in coordinates:
+                points[station_code].append((coordinates["x"], coordinates["y"]))
+        centres = {
+            station_code: (
+                sum(x for x, _ in xys) / len(xys),
+                sum(y for _, y in xys) / len(xys),
+            )
+            for station_code, xys in points.items()
+        }
+        width = int(max((x for x, _ in centres.values()), default=0)) + self.MARGIN
+        height = int(max((y for _, y in centres.values()), default=0)) + self.MARGIN
+        image = Image.new("RGB", (max(width, 1), max(height, 1)), self.BACKGROUND)
+        draw = ImageDraw.Draw(image)
+        for line, stations in self.network.routes.items():
+            draw.line(
+                [centres[code] for code in stations if code in centres],
+                fill=self.LINE_COLOURS.get(line, "grey"),
+                width=6,
+                joint="curve",
+            )
+        for code, (x, y) in centres.items():
+            draw.ellipse((x - 5, y - 5, x + 5, y + 5), fill="white", outline="black")
+            draw.text((x + 8, y + 6), code, fill="black")
+        return image
+
+    def _glyph_box(self, draw: ImageDraw.ImageDraw, trn: str, glyph: Glyph) -> Box:
+        x, y, direction, _ = glyph
+        arrow = self.ARROWS[direction]
+        xs = [x + dx for dx, _ in arrow[:4]]
+        ys = [y + dy for _, dy in arrow[:4]]
+        text = draw.textbbox((x + arrow[4][0], y + arrow[4][1]), trn)
+        return self._clamp(
+            (
+                int(min(*xs, text[0])) - 3,
+                int(min(*ys, text[1])) - 3,
+                int(max(*xs, text[2])) + 4,
+                int(max(*ys, text[3])) + 4,
+            )
+        )
+
+    def _draw_glyph(self, draw: ImageDraw.ImageDraw, trn: str, glyph: Glyph) -> None:
+        x, y, direction, colour = glyph
+        tail, head, left, right, text = (
+            (x + dx, y + dy) for dx, dy in self.ARROWS[direction]
+        )
+        draw.line([tail, head, left, head, right], fill=colour, width=4)
+        draw.text(text, trn, fill=colour)
+
+    def _clamp(self, box: Box) -> Box:
+        width, height = self._base.size
+        return (
+            min(max(int(box[0]), 0), width),
+            min(max(int(box[1]), 0), height),
+            min(max(int(box[2]), 0), width),
+            min(max(int(box[3]), 0), height),
+        )
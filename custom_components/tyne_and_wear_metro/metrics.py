@@ -0,0 +1,120 @@
+"""Runtime metrics for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any
+
+
+class MetroEndpointMetrics:
+    __slots__ = ("bytes", "errors", "histogram", "latency", "requests")
+
+    # Upper bounds in seconds, the last bucket counts everything slower
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self) -> None:
+        self.requests, self.errors, self.bytes, self.latency = 0, 0, 0, 0.0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+
+    def record(self, latency: float, size: int) -> None:
+        self.requests += 1
+        self.bytes += size
+        self.latency += latency
+        self.histogram[bisect_left(self.BUCKETS, latency)] += 1
+
+    @property
+    def mean_latency(self) -> float | None:
+        return self.latency / self.requests if self.requests else None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "mean_latency": self.mean_latency,
+            "histogram": dict(
+                zip(
+                    [f"<={bucket}s" for bucket in self.BUCKETS] + ["slower"],
+                    self.histogram,
+                    strict=True,
+                )
+            ),
+        }
+
+
+class MetroMetrics:
+    """Counters for API traffic and coordinator refreshes."""
+
+    def __init__(self) -> None:
+        self.endpoints: defaultdict[str, MetroEndpointMetrics] = defaultdict(
+            MetroEndpointMetrics
+        )
+        self.refreshes = 0
+        self.refresh_duration: float | None = None
+        self.platforms_refreshed, self.platforms_failed, self.platforms_skipped = (
+            0,
+            0,
+            0,
+        )
+        self.trains_tracked = 0
+
+    @staticmethod
+    def endpoint(path: str) -> str:
+        return path.split("/", 1)[0]
+
+    def record_request(self, path: str, latency: float, size: int) -> None:
+        self.endpoints[self.endpoint(path)].record(latency, size)
+
+    def record_error(self, path: str) -> None:
+        self.endpoints[self.endpoint(path)].errors += 1
+
+    def record_refresh(
+        self,
+        duration: float,
+        refreshed: int,
+        failed: int,
+        skipped: int,
+        trains: int,
+    ) -> None:
+        """Record one coordinator tick, counts are for that tick only."""
+        self.refreshes += 1
+        self.refresh_duration = duration
+        self.platforms_refreshed, self.platforms_failed, self.platforms_skipped = (
+            refreshed,
+            failed,
+            skipped,
+        )
+        self.trains_tracked = trains
+
+    @property
+    def requests(self) -> int:
+        return sum(endpoint.requests for endpoint in self.endpoints.values())
+
+    @property
+    def errors(self) -> int:
+        return sum(endpoint.errors for endpoint in self.endpoints.values())
+
+    @property
+    def bytes(self) -> int:
+        return sum(endpoint.bytes for endpoint in self.endpoints.values())
+
+    @property
+    def mean_latency(self) -> float | None:
+        requests = self.requests
+        if not requests:
+            return None
+        return sum(endpoint.latency for endpoint in self.endpoints.values()) / requests
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "endpoints": {
+                name: endpoint.as_dict() for name, endpoint in self.endpoints.items()
+            },
+            "refreshes": self.refreshes,
+            "refresh_duration": self.refresh_duration,
+            "platforms_refreshed": self.platforms_refreshed,
+            "platforms_failed": self.platforms_failed,
+            "platforms_skipped": self.platforms_skipped,
+            "trains_tracked": self.trains_tracked,
+        }
@@ -1,15 +1,31 @@
 from __future__ import annotations
 
-from collections import defaultdict
-from datetime import datetime
+import asyncio
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+import gzip
+import hashlib
+import json
+from pathlib import Path
+import time
+from typing import Any
 
 import aiohttp
 
+from .metrics import MetroMetrics
+
+TOPOLOGY_PATH = Path(__file__).parent / "topology.json"
+
 
 class MetroException(Exception):
     pass
 
 
+class MetroCircuitOpenException(MetroException):
+    pass
+
+
 class MetroStationNameException(Exception):
     pass
 
@@ -18,13 +34,49 @@ class MetroStationCodeException(Exception):
     pass
 
 
+class MetroArrival:
+    __slots__ = ("due_in", "due_time", "scheduled_time", "source")
+
+    def __init__(
+        self,
+        due_in: int,
+        due_time: datetime | None,
+        scheduled_time: datetime | None,
+        source: tuple = (),
+    ) -> None:
+        self.due_in, self.due_time, self.scheduled_time = (
+            due_in,
+            due_time,
+            scheduled_time,
+        )
+        # The raw fields this was parsed from
+        self.source = source
+
+
 class MetroTrain:
+    __slots__ = (
+        "_arrivals",
+        "_focus_platform_code",
+        "_focus_station_code",
+        "destination",
+        "last_event",
+        "last_event_location",
+        "last_event_time",
+        "last_seen",
+        "line",
+        "network",
+        "revision",
+        "source",
+        "trn",
+    )
+
     line: str
     destination: MetroStation
     last_event: str
     last_event_location: str
     last_event_time: datetime | None
-    _data: defaultdict[str, defaultdict[str, dict]]
+    last_seen: datetime
+    _arrivals: dict[tuple[str, str], MetroArrival]
 
     def __init__(
         self,
@@ -35,7 +87,9 @@ class MetroTrain:
         self.network = network
         self.trn = train_data["trn"]
         self._focus_station_code, self._focus_platform_code = "", ""
-        self._data = defaultdict(lambda: defaultdict(dict))
+        self._arrivals = {}
+        # Bumped whenever the fields shared by every arrival change
+        self.revision, self.source = 0, ()
         self.update(platform, train_data)
 
     def update(self, platform: MetroPlatform, train_data: dict[str, str]) -> None:
@@ -43,16 +97,44 @@ class MetroTrain:
             platform.station.station_code,
             platform.platform_code,
         )
-        self.line = train_data["line"]
-        self.destination = self.network.get_station_by_name(train_data["destination"])
-        self.last_event = train_data["lastEvent"]
-        self.last_event_location = train_data["lastEventLocation"]
-        self.last_event_time = self.get_date(train_data["lastEventTime"])
-        self._data[platform.station.station_code][platform.platform_code] = {
-            "due_in": train_data["dueIn"],
-            "due_time": self.get_date(train_data["actualPredictedTime"]),
-            "scheduled_time": self.get_date(train_data["actualScheduledTime"]),
-        }
+        # Only parse what has changed since the train was last reported
+        source = (
+            train_data["line"],
+            train_data["destination"],
+            train_data["lastEvent"],
+            train_data["lastEventLocation"],
+            train_data["lastEventTime"],
+        )
+        if source != self.source:
+            self.line = train_data["line"]
+            self.destination = self.network.get_station_by_name(
+                train_data["destination"]
+            )
+            self.last_event = train_data["lastEvent"]
+            self.last_event_location = train_data["lastEventLocation"]
+            self.last_event_time = self.get_date(train_data["lastEventTime"])
+            self.source = source
+            self.revision += 1
+        self.last_seen = datetime.now()
+        key = (self._focus_station_code, self._focus_platform_code)
+        source = (
+            train_data["dueIn"],
+            train_data["actualPredictedTime"],
+            train_data["actualScheduledTime"],
+        )
+        if (arrival := self._arrivals.get(key)) is None or arrival.source != source:
+            self._arrivals[key] = MetroArrival(
+                train_data["dueIn"],
+                self.get_date(train_data["actualPredictedTime"]),
+                self.get_date(train_data["actualScheduledTime"]),
+                source,
+            )
+
+    def forget(self, station_code: str, platform_code: str) -> None:
+        self._arrivals.pop((station_code, platform_code), None)
+
+    def list_arrivals(self):
+        yield from self._arrivals.items()
 
     def focus(self, station_code: str, platform_code: str) -> tuple[str, str]:
         was_station_code, was_platform_code = (
@@ -72,21 +154,21 @@ class MetroTrain:
             case _:
                 return None
 
+    @property
+    def arrival(self) -> MetroArrival:
+        return self._arrivals[self._focus_station_code, self._focus_platform_code]
+
     @property
     def due_in(self):
-        return self._data[self._focus_station_code][self._focus_platform_code]["due_in"]
+        return self.arrival.due_in
 
     @property
     def due_time(self):
-        return self._data[self._focus_station_code][self._focus_platform_code][
-            "due_time"
-        ]
+        return self.arrival.due_time
 
     @property
     def scheduled_time(self):
-        return self._data[self._focus_station_code][self._focus_platform_code][
-            "scheduled_time"
-        ]
+        return self.arrival.scheduled_time
 
     @property
     def last_update(self):
@@ -101,18 +183,18 @@ class MetroTrain:
     ) -> dict[str, str]:
         if station_code is not None and platform_code is not None:
             was_station, was_platform = self.focus(station_code, platform_code)
+        arrival = self.arrival
         data = {
             "trn": self.trn,
             "line": self.line,
             "destination_name": self.destination.station_name,
             "destination_code": self.destination.station_code,
-            "last_update": self.last_update,
             "last_event": self.last_event,
             "last_event_location": self.last_event_location,
             "last_event_time": self.last_event_time,
-            "due_in": self.due_in,
-            "due_time": self.due_time,
-            "scheduled_time": self.scheduled_time,
+            "due_in": arrival.due_in,
+            "due_time": arrival.due_time,
+            "scheduled_time": arrival.scheduled_time,
         }
         if station_code is not None and platform_code is not None:
             self.focus(was_station, was_platform)
@@ -126,28 +208,29 @@ class MetroPlatform:
         station: MetroStation,
         platform_code: str,
         platform_description: str,
+        direction: str | None = None,
+        coordinates: dict[str, Any] | None = None,
     ):
         self.network, self.station = network, station
         self.platform_code, self.platform_description = (
             platform_description,
             platform_code,
         )
+        self.direction = direction
+        # latitude/longitude, plus x, y and d(irection) on the network map
+        self.coordinates = coordinates or {}
         self.arrivals: list[MetroTrain] = []
         self.last_update = self.network.last_update
 
     async def update(self):
-        self.arrivals = []
-        for time in await self.network.api.async_get_times(
+        times = await self.network.api.async_get_times(
             self.station.station_code, self.platform_code
-        ):
-            if time["trn"] in self.network.trains:
-                train = self.network.trains["trn"]
-                train.update(self, time)
-            else:
-                train = MetroTrain(self.network, self, time)
-            self.arrivals.append(train)
-        self.arrivals.sort(key=lambda x: x.due_in)
-        self.last_update = self.network.last_update
+        )
+        arrivals = [self.network.add_train(self, time) for time in times]
+        for train in set(self.arrivals).difference(arrivals):
+            train.forget(self.station.station_code, self.platform_code)
+        self.arrivals = sorted(arrivals, key=lambda x: x.due_in)
+        self.last_update = datetime.now()
 
     def list_trains(self):
         yield from self.arrivals
@@ -161,22 +244,28 @@ class MetroStation:
             station_code,
         )
         self.platforms: dict[str, MetroPlatform] = {}
-        self._hydrated = False
         self.last_update = self.network.last_update
 
     async def hydrate(self, platform_data):
-        if self._hydrated:
-            return
+        """Add any of these platforms the station does not have yet."""
         for platform in platform_data:
+            if f"{platform['platformNumber']}" in self.platforms:
+                continue
             self.platforms[f"{platform['platformNumber']}"] = MetroPlatform(
                 self.network,
                 self,
                 platform["helperText"],
                 f"{platform['platformNumber']}",
+                platform.get("direction"),
+                platform.get("coordinates"),
             )
-        self.hydrated = True
         self.last_update = self.network.last_update
 
+    def remove(self, platform_code: str) -> None:
+        if (platform := self.platforms.pop(platform_code, None)) is not None:
+            for train in platform.arrivals:
+                train.forget(self.station_code, platform_code)
+
     async def update(self, platform_code: str):
         await self.platforms[platform_code].update()
         self.last_update = self.network.last_update
@@ -189,38 +278,177 @@ class MetroStation:
 
 
 class MetroNetwork:
-    def __init__(self):
-        self.api = MetroAPI()
+    TRAIN_TTL = timedelta(minutes=10)
+    MAX_TRAINS = 500
+
+    def __init__(
+        self,
+        api: MetroAPI | None = None,
+        train_ttl: timedelta = TRAIN_TTL,
+        max_trains: int = MAX_TRAINS,
+        selection: set[tuple[str, str]] | None = None,
+    ):
+        self.api = api if api is not None else MetroAPI()
+        # (station_code, platform_code) to hydrate, None for every platform
+        self.selection = selection
         self.stations: dict[str, MetroStation] = {}
+        # Topology records for every platform, hydrated or not
+        self.platform_data: dict[tuple[str, str], dict[str, Any]] = {}
         self.trains: dict[str, MetroTrain] = {}
+        self.train_ttl, self.max_trains = train_ttl, max_trains
         self.name_to_code = {}
+        self.routes: dict[str, list[str]] = {}
+        self.topology_version: int | None = None
+        self.topology_fingerprint: str | None = None
         self._hydrated = False
         self.last_update = datetime.now()
 
     async def hydrate(self):
+        """Build the network from the bundled topology snapshot."""
         if self._hydrated:
             return
+        topology = await asyncio.to_thread(self.load_topology)
+        self.topology_version = topology["version"]
+        self.routes = topology["routes"]
+        await self._build(topology["stations"], topology["platforms"])
+        self._hydrated = True
+        self.last_update = datetime.now()
+
+    async def revalidate(self) -> bool:
+        """Check the snapshot against the API, rebuilding only if it changed."""
         platform_data = await self.api.async_get_platforms()
         station_data = await self.api.async_get_stations()
-        self.stations = {
+        if self.fingerprint(station_data, platform_data) == self.topology_fingerprint:
+            return False
+        await self._build(station_data, platform_data)
+        self.topology_version = None
+        self.last_update = datetime.now()
+        return True
+
+    @staticmethod
+    def load_topology() -> dict:
+        with TOPOLOGY_PATH.open(encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def fingerprint(station_data: dict, platform_data: dict) -> str:
+        # Only the fields the network is built from, the snapshot also
+        # carries hand-placed map coordinates that the API does not.
+        platforms = {
+            station_code: [
+                [p["platformNumber"], p.get("direction"), p["helperText"]]
+                for p in platforms
+            ]
+            for station_code, platforms in platform_data.items()
+        }
+        return hashlib.sha256(
+            json.dumps([station_data, platforms], sort_keys=True).encode()
+        ).hexdigest()
+
+    async def _build(self, station_data: dict, platform_data: dict):
+        stations = {
             station_code: MetroStation(self, station_name, station_code)
             for station_code, station_name in station_data.items()
         }
-        self.name_to_code = {
+        self.platform_data = {
+            (station_code, f"{platform['platformNumber']}"): platform
+            for station_code, platforms in platform_data.items()
+            for platform in platforms
+        }
+        for station_code, station in stations.items():
+            await station.hydrate(self._selected_data(station_code))
+        name_to_code = {
             station.station_name: station_code
-            for station_code, station in self.stations.items()
+            for station_code, station in stations.items()
         }
-        self.name_to_code["Monument"] = "MTS"
-        self.name_to_code["St. James"] = "SJM"
+        name_to_code["Monument"] = "MTS"
+        name_to_code["St. James"] = "SJM"
+        self.stations, self.name_to_code = stations, name_to_code
+        self.topology_fingerprint = self.fingerprint(station_data, platform_data)
+
+    def is_selected(self, station_code: str, platform_code: str) -> bool:
+        return self.selection is None or (station_code, platform_code) in self.selection
+
+    def _selected_data(self, station_code: str) -> list[dict[str, Any]]:
+        return [
+            platform
+            for (code, platform_code), platform in self.platform_data.items()
+            if code == station_code and self.is_selected(code, platform_code)
+        ]
+
+    async def select(
+        self, selection: set[tuple[str, str]] | None
+    ) -> tuple[set[tuple[str, str]], set[tuple[str, str]]]:
+        """Hydrate newly selected platforms and drop the rest.
+
+        Returns the (station_code, platform_code) pairs added and removed.
+        """
+        before = self.platform_keys()
+        self.selection = selection
         for station_code, station in self.stations.items():
-            await station.hydrate(platform_data[station_code])
-        self._hydrated = True
-        self.last_update = datetime.now()
+            for platform_code in list(station.platforms):
+                if not self.is_selected(station_code, platform_code):
+                    station.remove(platform_code)
+            await station.hydrate(self._selected_data(station_code))
+        after = self.platform_keys()
+        return after - before, before - after
+
+    def platform_keys(self) -> set[tuple[str, str]]:
+        return {
+            (platform.station.station_code, platform.platform_code)
+            for platform in self.list_platforms()
+        }
 
     async def update(self, station_code: str, platform_code: str):
         await self.stations[station_code].update(platform_code)
         self.last_update = datetime.now()
 
+    async def close(self):
+        await self.api.close()
+
+    def add_train(self, platform: MetroPlatform, train_data: dict[str, str]):
+        """Update the registered train for this trn, registering it if new."""
+        if (train := self.trains.get(train_data["trn"])) is not None:
+            train.update(platform, train_data)
+        else:
+            train = MetroTrain(self, platform, train_data)
+            self.trains[train.trn] = train
+        return train
+
+    def evict_trains(self, now: datetime | None = None) -> int:
+        """Drop trains not seen within the TTL, then the oldest over the cap."""
+        cutoff = (now or datetime.now()) - self.train_ttl
+        evicted = {
+            trn for trn, train in self.trains.items() if train.last_seen < cutoff
+        }
+        if len(self.trains) - len(evicted) > self.max_trains:
+            survivors = sorted(
+                (train for trn, train in self.trains.items() if trn not in evicted),
+                key=lambda train: train.last_seen,
+            )
+            evicted.update(
+                train.trn for train in survivors[: len(survivors) - self.max_trains]
+            )
+        if not evicted:
+            return 0
+        for trn in evicted:
+            del self.trains[trn]
+        for platform in self.list_platforms():
+            platform.arrivals = [
+                train for train in platform.arrivals if train.trn not in evicted
+            ]
+        return len(evicted)
+
+    def get_train(self, trn: str) -> MetroTrain | None:
+        return self.trains.get(trn)
+
+    def list_line_trains(self, line: str):
+        """Yield every known train on a line, e.g. "Green" or "Yellow"."""
+        line = line.casefold()
+        for train in self.trains.values():
+            if train.line.casefold() == line:
+                yield train
+
     def list_stations(self):
         yield from self.stations.values()
 
@@ -237,6 +465,19 @@ class MetroNetwork:
         except KeyError as e:  # noqa: F841
             raise MetroStationCodeException(f"No station with code {station_code}")
 
+    def locate(self, location: str) -> tuple[str, str] | None:
+        """Station and platform codes of a lastEventLocation like "Haymarket Platform 1".
+
+        Works for every platform in the topology, hydrated or not.
+        """
+        station_name, _, platform_code = location.rpartition(" Platform ")
+        station_code = self.name_to_code.get(station_name)
+        if station_code == "MTS" and platform_code in ("3", "4"):
+            station_code = "MTW"
+        if (station_code, platform_code) not in self.platform_data:
+            return None
+        return station_code, platform_code
+
     def get_station_by_name(self, station_name: str) -> MetroStation:
         try:
             return self.stations[self.name_to_code[station_name]]
@@ -247,18 +488,161 @@ class MetroNetwork:
 
 class MetroAPI:
     API_BASE = "https://metro-rti.nexus.org.uk/api/"
+    LIMIT_PER_HOST = 4
+    TIMEOUT = 10
+    KEEPALIVE_TIMEOUT = 60
+    # Seconds to cache responses for, by the first segment of the path
+    CACHE_TTL = {"times": 10, "stations": 3600}
+    CACHE_SIZE = 256
+    CAPTURE_BATCH = 50
+    # Consecutive failures before requests stop, and seconds until one is
+    # let through to see if the API has recovered
+    BREAKER_THRESHOLD = 5
+    BREAKER_COOLDOWN = 30
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession | None = None,
+        limit_per_host: int = LIMIT_PER_HOST,
+        timeout: float = TIMEOUT,
+        capture_path: str | Path | None = None,
+    ):
+        """Pass a shared session to reuse it, otherwise a pooled one is owned.
 
-    def __init__(self):
+        With a capture_path every raw response is appended to a gzipped JSONL
+        archive of path, timestamp and body, which MetroReplayAPI can serve.
+        """
         self.last_update = datetime.now()
+        self._session = session
+        self._owns_session = session is None
+        self._limit_per_host = limit_per_host
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._cache: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.cache_hits, self.cache_misses, self.coalesced = 0, 0, 0
+        self.metrics = MetroMetrics()
+        self.failures = 0
+        self.open_until = 0.0
+        self._trial = False
+        self.capture_path = capture_path
+        self._captures: list[str] = []
+        self._capture_lock = asyncio.Lock()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._owns_session = True
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self._limit_per_host,
+                    keepalive_timeout=self.KEEPALIVE_TIMEOUT,
+                    ttl_dns_cache=300,
+                ),
+                timeout=self._timeout,
+            )
+        return self._session
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    async def close(self):
+        for task in self._inflight.values():
+            task.cancel()
+        self._cache.clear()
+        await self.async_flush_captures()
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+        self._session = None
 
     async def async_get_json(self, path):
-        async with aiohttp.ClientSession() as session:  # noqa: SIM117
-            async with session.request("GET", f"{self.API_BASE}{path}") as response:
+        """Get a path, from the cache or by joining an identical request in flight."""
+        if (cached := self._cache.get(path)) is not None:
+            if cached[0] > time.monotonic():
+                self._cache.move_to_end(path)
+                self.cache_hits += 1
+                return cached[1]
+            del self._cache[path]
+        if (task := self._inflight.get(path)) is not None:
+            self.coalesced += 1
+        else:
+            self.cache_misses += 1
+            task = asyncio.create_task(self._async_fetch_and_cache(path))
+            self._inflight[path] = task
+            task.add_done_callback(lambda _: self._inflight.pop(path, None))
+        return await asyncio.shield(task)
+
+    async def _async_fetch_and_cache(self, path):
+        j = await self.async_fetch_json(path)
+        if ttl := self.CACHE_TTL.get(path.split("/", 1)[0]):
+            self._cache[path] = (time.monotonic() + ttl, j)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return j
+
+    @property
+    def breaker_open(self) -> bool:
+        return self.failures >= self.BREAKER_THRESHOLD
+
+    def _check_breaker(self, path: str) -> bool:
+        """Raise if the breaker is open, returning whether this is a trial."""
+        if not self.breaker_open:
+            return False
+        if time.monotonic() < self.open_until or self._trial:
+            raise MetroCircuitOpenException(
+                f"Not requesting {path} after {self.failures} failures in a row"
+            )
+        # Half open, this request decides whether to close the breaker
+        self._trial = True
+        return True
+
+    def _record_failure(self, error: Exception) -> None:
+        if isinstance(error, aiohttp.ClientResponseError) and error.status < 500:
+            # The API answered, the request was wrong
+            return
+        self.failures += 1
+        if self.breaker_open:
+            self.open_until = time.monotonic() + self.BREAKER_COOLDOWN
+
+    async def async_fetch_json(self, path):
+        trial = self._check_breaker(path)
+        start = time.perf_counter()
+        try:
+            async with self.session.get(
+                f"{self.API_BASE}{path}", timeout=self._timeout
+            ) as response:
                 response.raise_for_status()
-                j = await response.json()
+                body = await response.read()
+        except (aiohttp.ClientError, TimeoutError) as e:
+            self.metrics.record_error(path)
+            self._record_failure(e)
+            raise
+        finally:
+            if trial:
+                self._trial = False
+        self.failures = 0
+        self.metrics.record_request(path, time.perf_counter() - start, len(body))
+        j = json.loads(body)
         self.last_update = datetime.now()
+        if self.capture_path is not None:
+            self._captures.append(
+                json.dumps({"path": path, "timestamp": time.time(), "body": j})
+            )
+            if len(self._captures) >= self.CAPTURE_BATCH:
+                await self.async_flush_captures()
         return j
 
+    async def async_flush_captures(self):
+        if not self._captures:
+            return
+        lines, self._captures = self._captures, []
+        async with self._capture_lock:
+            await asyncio.to_thread(self._write_captures, lines)
+
+    def _write_captures(self, lines: list[str]):
+        with gzip.open(self.capture_path, "at", encoding="utf-8") as f:
+            f.writelines(f"{line}\n" for line in lines)
+
     async def async_get_times(self, station_code, platform_number):
         return await self.async_get_json(f"times/{station_code}/{platform_number}")
 
@@ -267,3 +651,61 @@ class MetroAPI:
 
     async def async_get_platforms(self):
         return await self.async_get_json("stations/platforms")
+
+
+class MetroReplayAPI(MetroAPI):
+    """Serve responses from a capture archive instead of the Nexus API.
+
+    With a speed the capture is replayed against a clock running that many
+    times faster than real time, answering each path with the latest response
+    captured before that moment. Without one, each request for a path gets
+    the next captured response for it, as fast as they are asked for.
+    """
+
+    CACHE_TTL = {}
+
+    def __init__(self, capture_path: str | Path, speed: float | None = 1.0):
+        super().__init__()
+        self.replay_path, self.speed = capture_path, speed
+        self._responses: dict[str, tuple[list[float], list[Any]]] = {}
+        self._cursors: defaultdict[str, int] = defaultdict(int)
+        self._origin: float | None = None
+        self._started = 0.0
+
+    def load(self) -> dict[str, tuple[list[float], list[Any]]]:
+        responses: dict[str, tuple[list[float], list[Any]]] = {}
+        with gzip.open(self.replay_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                capture = json.loads(line)
+                timestamps, bodies = responses.setdefault(capture["path"], ([], []))
+                timestamps.append(capture["timestamp"])
+                bodies.append(capture["body"])
+        return responses
+
+    @property
+    def paths(self) -> set[str]:
+        return set(self._responses)
+
+    async def async_load(self):
+        self._responses = await asyncio.to_thread(self.load)
+        self._origin = min(
+            (timestamps[0] for timestamps, _ in self._responses.values()),
+            default=0.0,
+        )
+        self._started = time.monotonic()
+
+    async def async_fetch_json(self, path):
+        if self._origin is None:
+            await self.async_load()
+        try:
+            timestamps, bodies = self._responses[path]
+        except KeyError as e:
+            raise MetroException(f"No captured response for {path}") from e
+        if self.speed is None:
+            index = min(self._cursors[path], len(bodies) - 1)
+            self._cursors[path] += 1
+        else:
+            now = self._origin + (time.monotonic() - self._started) * self.speed
+            index = max(bisect_right(timestamps, now) - 1, 0)
+        self.last_update = datetime.now()
+        return bodies[index]
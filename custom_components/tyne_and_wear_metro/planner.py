@@ -0,0 +1,308 @@
+"""Journey planning for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+import heapq
+from itertools import pairwise
+from typing import TYPE_CHECKING, Any
+
+from .inference import MetroInference
+
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
+    from .metro import MetroNetwork
+
+# (station_code, line, direction) of a passenger on board a train
+type RideState = tuple[str, str, str]
+
+
+@dataclass(frozen=True, slots=True)
+class MetroLeg:
+    line: str
+    direction: str
+    board: str
+    alight: str
+    stops: int
+    run_time: float
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "line": self.line,
+            "direction": self.direction,
+            "from": self.board,
+            "to": self.alight,
+            "stops": self.stops,
+            "run_time": round(self.run_time),
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class MetroJourney:
+    origin: str
+    destination: str
+    # Where the first train is caught, which is only not the origin when
+    # walking between the Monument platforms first
+    station: str
+    platform: str | None
+    walk: float
+    legs: tuple[MetroLeg, ...]
+    duration: float
+
+
+class MetroJourneyPlanner:
+    """Fastest routes between every pair of stations, joined to live departures.
+
+    The index holds, for each origin and destination, the fastest journey
+    starting with each line and direction that serves the origin. A query
+    looks those up and picks whichever reaches the destination first given
+    the next train that can take each of them.
+    """
+
+    # Seconds allowed for changing trains, and for walking between the
+    # Monument N-S and W-E platforms
+    TRANSFER_TIME = 120.0
+    INTERCHANGES = {("MTS", "MTW"): 180.0, ("MTW", "MTS"): 180.0}
+    # Rebuild now and then so that learned run times are picked up
+    REBUILD_INTERVAL = timedelta(hours=1)
+
+    def __init__(
+        self, network: MetroNetwork, inference: MetroInference | None = None
+    ) -> None:
+        self.network, self.inference = network, inference
+        self._journeys: dict[tuple[str, str], list[MetroJourney]] = {}
+        self._topology: str | None = None
+        self._built: datetime | None = None
+        self._build_lock = asyncio.Lock()
+
+    def _run_time(self, from_code: str, to_code: str) -> float:
+        if self.inference is None:
+            return MetroInference.DEFAULT_RUN_TIME
+        return self.inference.run_times.get(
+            (from_code, to_code), MetroInference.DEFAULT_RUN_TIME
+        )
+
+    def _services(self, station_code: str) -> list[tuple[str, str]]:
+        """List the (line, direction) pairs a train can leave a station on."""
+        services = []
+        for line, route in self.network.routes.items():
+            if station_code not in route:
+                continue
+            index = route.index(station_code)
+            if index < len(route) - 1:
+                services.append((line, "IN"))
+            if index > 0:
+                services.append((line, "OUT"))
+        return services
+
+    def _next_station(self, state: RideState) -> str | None:
+        station_code, line, direction = state
+        route = self.network.routes[line]
+        index = route.index(station_code) + (1 if direction == "IN" else -1)
+        return route[index] if 0 <= index < len(route) else None
+
+    def _neighbours(self, state: RideState):
+        station_code, line, direction = state
+        if (next_code := self._next_station(state)) is not None:
+            yield (next_code, line, direction), self._run_time(station_code, next_code)
+        for service in self._services(station_code):
+            if service != (line, direction):
+                yield (station_code, *service), self.TRANSFER_TIME
+        for (from_code, to_code), walk in self.INTERCHANGES.items():
+            if from_code == station_code:
+                for service in self._services(to_code):
+                    yield (to_code, *service), walk
+
+    def _search(self, start: RideState) -> dict[str, tuple[float, list[RideState]]]:
+        """Dijkstra from one boarding, giving the time and path to each station."""
+        best: dict[RideState, float] = {start: 0.0}
+        parents: dict[RideState, RideState] = {}
+        reached: dict[str, tuple[float, RideState]] = {}
+        heap = [(0.0, start)]
+        while heap:
+            cost, state = heapq.heappop(heap)
+            if cost > best[state]:
+                continue
+            if state[0] not in reached:
+                reached[state[0]] = (cost, state)
+            for neighbour, step in self._neighbours(state):
+                if cost + step < best.get(neighbour, float("inf")):
+                    best[neighbour] = cost + step
+                    parents[neighbour] = state
+                    heapq.heappush(heap, (cost + step, neighbour))
+        paths = {}
+        for station_code, (cost, state) in reached.items():
+            path = [state]
+            while path[-1] in parents:
+                path.append(parents[path[-1]])
+            paths[station_code] = (cost, path[::-1])
+        return paths
+
+    def _legs(self, path: list[RideState]) -> tuple[MetroLeg, ...]:
+        legs = []
+        board, stops, run_time = path[0], 0, 0.0
+        for previous, state in pairwise(path):
+            if state[1:] == previous[1:] and state[0] == self._next_station(previous):
+                stops += 1
+                run_time += self._run_time(previous[0], state[0])
+                continue
+            if stops:
+                legs.append(
+                    MetroLeg(*board[1:], board[0], previous[0], stops, run_time)
+                )
+            board, stops, run_time = state, 0, 0.0
+        if stops:
+            legs.append(MetroLeg(*board[1:], board[0], path[-1][0], stops, run_time))
+        return tuple(legs)
+
+    def _platform(self, station_code: str, direction: str) -> str | None:
+        for (code, platform_code), platform in self.network.platform_data.items():
+            if code == station_code and platform.get("direction") == direction:
+                return platform_code
+        return None
+
+    def build(self) -> None:
+        """Precompute the fastest journeys between every pair of stations."""
+        journeys: dict[tuple[str, str], list[MetroJourney]] = {}
+        for origin in self.network.stations:
+            boardings = [(origin, 0.0)] + [
+                (to_code, walk)
+                for (from_code, to_code), walk in self.INTERCHANGES.items()
+                if from_code == origin
+            ]
+            for station_code, walk in boardings:
+                for line, direction in self._services(station_code):
+                    platform = self._platform(station_code, direction)
+                    for destination, (cost, path) in self._search(
+                        (station_code, line, direction)
+                    ).items():
+                        if destination in (origin, station_code):
+                            continue
+                        legs = self._legs(path)
+                        # Journeys that change straight away are covered
+                        # by the one boarding the other service
+                        if (
+                            not legs
+                            or legs[0].board != station_code
+                            or (legs[0].line, legs[0].direction) != (line, direction)
+                        ):
+                            continue
+                        journeys.setdefault((origin, destination), []).append(
+                            MetroJourney(
+                                origin,
+                                destination,
+                                station_code,
+                                platform,
+                                walk,
+                                legs,
+                                walk + cost,
+                            )
+                        )
+        for options in journeys.values():
+            options.sort(key=lambda journey: journey.duration)
+        self._journeys = journeys
+        self._topology = self.network.topology_fingerprint
+        self._built = datetime.now()
+
+    @property
+    def stale(self) -> bool:
+        return (
+            self._built is None
+            or self._topology != self.network.topology_fingerprint
+            or datetime.now() - self._built > self.REBUILD_INTERVAL
+        )
+
+    async def async_build(self, hass: HomeAssistant) -> None:
+        """Rebuild in the executor if stale, one rebuild at a time."""
+        async with self._build_lock:
+            if self.stale:
+                await hass.async_add_executor_job(self.build)
+
+    def journeys(self, origin: str, destination: str) -> list[MetroJourney]:
+        if self.stale:
+            self.build()
+        return self._journeys.get((origin, destination), [])
+
+    def platforms(self, origin: str, destination: str) -> set[tuple[str, str]]:
+        """Platforms a journey between two stations could start from."""
+        return {
+            (journey.station, journey.platform)
+            for journey in self.journeys(origin, destination)
+            if journey.platform is not None
+        }
+
+    def plan(
+        self,
+        origin: str,
+        destination: str,
+        departures: Callable[[str, str], list[dict[str, Any]]],
+        now: datetime | None = None,
+    ) -> dict[str, Any] | None:
+        """Pick the journey arriving first.
+
+        departures gives the live departures for a station and platform code,
+        soonest first, like MetroDataUpdateCoordinator.trains.
+        """
+        now = now or datetime.now(UTC)
+        best = None
+        for journey in self.journeys(origin, destination):
+            leg = journey.legs[0]
+            route = self.network.routes[leg.line]
+            alight = route.index(leg.alight)
+            # Only trains that can still be caught after any walk
+            catchable = now + timedelta(seconds=journey.walk)
+            trains = (
+                departures(journey.station, journey.platform)
+                if journey.platform is not None
+                else []
+            )
+            departure = next(
+                (
+                    train
+                    for train in trains
+                    if train["line"].upper() == leg.line
+                    and train["due_time"] is not None
+                    and train["due_time"] >= catchable
+                    and train["destination_code"] in route
+                    and (route.index(train["destination_code"]) - alight)
+                    * (1 if leg.direction == "IN" else -1)
+                    >= 0
+                ),
+                None,
+            )
+            leaves = departure["due_time"] if departure else None
+            arrives = (
+                leaves + timedelta(seconds=journey.duration - journey.walk)
+                if leaves is not None
+                else None
+            )
+            candidate = (journey, departure, arrives)
+            if best is None or (
+                arrives is not None and (best[2] is None or arrives < best[2])
+            ):
+                best = candidate
+        if best is None:
+            return None
+        journey, departure, arrives = best
+        return {
+            "origin": journey.origin,
+            "destination": journey.destination,
+            "station": journey.station,
+            "platform": journey.platform,
+            "duration": round(journey.duration),
+            "changes": len(journey.legs) - 1,
+            "legs": [leg.as_dict() for leg in journey.legs],
+            "departure": None
+            if departure is None
+            else {
+                "trn": departure["trn"],
+                "destination": departure["destination_name"],
+                "due_in": departure["due_in"],
+                "due_time": departure["due_time"].isoformat(),
+            },
+            "arrival_time": arrives.isoformat() if arrives is not None else None,
+        }
@@ -0,0 +1,201 @@
+"""Train position estimates for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import time
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from .inference import MetroInference
+
+if TYPE_CHECKING:
+    from .metro import MetroNetwork, MetroTrain
+
+# Start and end point, run time pair (-1 when standing at a platform), the
+# fraction of the way along already covered, and the last event time
+type Segment = tuple[int, int, int, float, float]
+
+
+@dataclass(frozen=True, slots=True)
+class MetroPositions:
+    """Where every located train is, one row per train.
+
+    positions has x, y, latitude and longitude columns, latitude and
+    longitude are NaN for platforms without them.
+    """
+
+    trns: tuple[str, ...]
+    lines: tuple[str, ...]
+    # Map arrow direction of the platform each train last reported from
+    arrows: tuple[str, ...]
+    positions: np.ndarray
+
+    def as_dict(self) -> dict[str, dict[str, Any]]:
+        return {
+            trn: {
+                "line": line,
+                "x": round(float(x)),
+                "y": round(float(y)),
+                "latitude": None if np.isnan(lat) else round(float(lat), 6),
+                "longitude": None if np.isnan(lon) else round(float(lon), 6),
+            }
+            for trn, line, (x, y, lat, lon) in zip(
+                self.trns, self.lines, self.positions, strict=True
+            )
+        }
+
+
+class MetroPositionEstimator:
+    """Interpolate trains between stations from their last reported event.
+
+    A train that departed a platform is moved towards the next station on its
+    line by the time since it left over the run time between them, and one
+    approaching a platform starts APPROACH_FRACTION of the way there. Each
+    train's segment is only worked out again when its reports change, the
+    interpolation itself is one NumPy pass over every train.
+    """
+
+    APPROACH_FRACTION = 0.75
+
+    def __init__(
+        self, network: MetroNetwork, inference: MetroInference | None = None
+    ) -> None:
+        self.network, self.inference = network, inference
+        self._points = np.empty((0, 4))
+        self._point_index: dict[tuple[str, str], int] = {}
+        self._by_direction: dict[tuple[str, str], int] = {}
+        self._pairs: list[tuple[str, str]] = []
+        self._pair_index: dict[tuple[str, str], int] = {}
+        # trn to the train and revision its segment and arrow were worked
+        # out from, a train that expired and came back starts a new revision
+        self._segments: dict[
+            str, tuple[MetroTrain, int, Segment | None, str | None]
+        ] = {}
+        self._topology: str | None = None
+        self.estimates, self.segments_built = 0, 0
+
+    def _build(self) -> None:
+        points, point_index, by_direction = [], {}, {}
+        for key, platform in self.network.platform_data.items():
+            coordinates = platform.get("coordinates", {})
+            if "x" not in coordinates:
+                continue
+            point_index[key] = len(points)
+            if (direction := platform.get("direction")) is not None:
+                by_direction.setdefault((key[0], direction), len(points))
+            points.append(
+                (
+                    coordinates["x"],
+                    coordinates["y"],
+                    coordinates.get("latitude", np.nan),
+                    coordinates.get("longitude", np.nan),
+                )
+            )
+        self._points = np.array(points, dtype=float).reshape(-1, 4)
+        self._point_index, self._by_direction = point_index, by_direction
+        self._pairs, self._pair_index, self._segments = [], {}, {}
+        self._topology = self.network.topology_fingerprint
+
+    def _run_time(self, from_code: str, to_code: str) -> float:
+        if self.inference is None:
+            return MetroInference.DEFAULT_RUN_TIME
+        return self.inference.run_times.get(
+            (from_code, to_code), MetroInference.DEFAULT_RUN_TIME
+        )
+
+    def _pair(self, from_code: str, to_code: str) -> int:
+        if (index := self._pair_index.get((from_code, to_code))) is None:
+            index = self._pair_index[from_code, to_code] = len(self._pairs)
+            self._pairs.append((from_code, to_code))
+        return index
+
+    def _segment(self, train: MetroTrain) -> tuple[Segment | None, str | None]:
+        if not train.last_event_location or train.last_event_time is None:
+            return None, None
+        key = self.network.locate(train.last_event_location)
+        if key is None or (point := self._point_index.get(key)) is None:
+            return None, None
+        arrow = self.network.platform_data[key]["coordinates"].get("d")
+        return self._route_segment(train, key, point), arrow
+
+    def _route_segment(
+        self, train: MetroTrain, key: tuple[str, str], point: int
+    ) -> Segment:
+        event_time = train.last_event_time.timestamp()
+        station_code = key[0]
+        direction = self.network.platform_data[key].get("direction")
+        route = self.network.routes.get((train.line or "").upper(), [])
+        if direction is None or station_code not in route:
+            return (point, point, -1, 0.0, event_time)
+        index = route.index(station_code)
+        step = 1 if direction == "IN" else -1
+        if train.last_event == "DEPARTED":
+            other = index + step
+        elif train.last_event == "APPROACHING":
+            other = index - step
+        else:
+            return (point, point, -1, 0.0, event_time)
+        if (
+            not 0 <= other < len(route)
+            or (other_point := self._by_direction.get((route[other], direction)))
+            is None
+        ):
+            return (point, point, -1, 0.0, event_time)
+        if train.last_event == "DEPARTED":
+            return (
+                point,
+                other_point,
+                self._pair(station_code, route[other]),
+                0.0,
+                event_time,
+            )
+        return (
+            other_point,
+            point,
+            self._pair(route[other], station_code),
+            self.APPROACH_FRACTION,
+            event_time,
+        )
+
+    def estimate(self, now: float | None = None) -> MetroPositions:
+        """Estimate every train's position at now, a Unix timestamp."""
+        if self._topology != self.network.topology_fingerprint:
+            self._build()
+        now = time.time() if now is None else now
+        trains = self.network.trains
+        for trn in self._segments.keys() - trains.keys():
+            del self._segments[trn]
+        trns, lines, arrows, segments = [], [], [], []
+        for trn, train in trains.items():
+            cached = self._segments.get(trn)
+            if cached is None or cached[0] is not train or cached[1] != train.revision:
+                cached = self._segments[trn] = (
+                    train,
+                    train.revision,
+                    *self._segment(train),
+                )
+                self.segments_built += 1
+            if (segment := cached[2]) is None:
+                continue
+            trns.append(trn)
+            lines.append(train.line)
+            arrows.append(cached[3])
+            segments.append(segment)
+        self.estimates += 1
+        if not segments:
+            return MetroPositions((), (), (), np.empty((0, 4)))
+
+        start, end, pair, covered, event_time = (
+            np.array(column) for column in zip(*segments, strict=True)
+        )
+        run_times = np.array(
+            [self._run_time(*pair_codes) for pair_codes in self._pairs] or [1.0]
+        )
+        # Standing trains have no pair and do not move
+        rate = np.where(pair >= 0, 1 / run_times[np.maximum(pair, 0)], 0.0)
+        fraction = np.clip(covered + (now - event_time) * rate, 0.0, 1.0)
+        origin = self._points[start]
+        positions = origin + fraction[:, None] * (self._points[end] - origin)
+        return MetroPositions(tuple(trns), tuple(lines), tuple(arrows), positions)
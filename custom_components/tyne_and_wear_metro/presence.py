@@ -0,0 +1,93 @@
+"""Presence driven refreshes for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+from homeassistant.const import ATTR_LATITUDE, ATTR_LONGITUDE
+from homeassistant.core import (
+    CALLBACK_TYPE,
+    Event,
+    EventStateChangedData,
+    HomeAssistant,
+    State,
+    callback,
+)
+from homeassistant.helpers.event import async_track_state_change_event
+
+if TYPE_CHECKING:
+    from .shared import MetroShared
+
+
+class MetroPresence:
+    """Lease a station's platforms while a person is at or near it.
+
+    A person is at a station when they are in a zone named after it, like the
+    ones in stations.md, and near one when within approach_distance metres of
+    it. Arriving fetches the station's departures straight away, so that they
+    are warm by the time anyone looks, and every move while there renews the
+    lease.
+    """
+
+    ZONE_SUFFIX = " Metro Station"
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        shared: MetroShared,
+        lease_length: timedelta,
+        approach_distance: float,
+    ) -> None:
+        self.hass, self.shared = hass, shared
+        self.lease_length, self.approach_distance = lease_length, approach_distance
+        # The station each tracked person is at or near
+        self._stations: dict[str, str | None] = {}
+        self.arrivals, self.renewals = 0, 0
+
+    @callback
+    def async_start(self, entity_ids: list[str]) -> CALLBACK_TYPE:
+        for entity_id in entity_ids:
+            self._update(entity_id, self.hass.states.get(entity_id))
+        return async_track_state_change_event(
+            self.hass, entity_ids, self._async_person_changed
+        )
+
+    @callback
+    def _async_person_changed(self, event: Event[EventStateChangedData]) -> None:
+        self._update(event.data["entity_id"], event.data["new_state"])
+
+    def _station(self, state: State | None) -> str | None:
+        if state is None:
+            return None
+        network = self.shared.network
+        zone = state.state.removesuffix(self.ZONE_SUFFIX)
+        if (station_code := network.name_to_code.get(zone)) is not None:
+            return station_code
+        if (
+            (latitude := state.attributes.get(ATTR_LATITUDE)) is not None
+            and (longitude := state.attributes.get(ATTR_LONGITUDE)) is not None
+            and (found := self.shared.index.nearest(latitude, longitude)) is not None
+            and found[1] <= self.approach_distance
+        ):
+            return found[0].station_code
+        return None
+
+    def _update(self, entity_id: str, state: State | None) -> None:
+        station_code = self._station(state)
+        arrived = station_code != self._stations.get(entity_id)
+        self._stations[entity_id] = station_code
+        if station_code is None:
+            return
+        network, coordinator = self.shared.network, self.shared.coordinator
+        for platform in network.stations[station_code].list_platforms():
+            # Platforms no entry chose are never hydrated
+            if network.is_selected(station_code, platform.platform_code):
+                coordinator.subscribe(
+                    station_code, platform.platform_code, self.lease_length
+                )
+        if arrived:
+            self.arrivals += 1
+            self.hass.async_create_task(coordinator.async_request_refresh())
+        else:
+            self.renewals += 1
@@ -2,18 +2,55 @@
 
 from __future__ import annotations
 
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass
 from datetime import datetime
 from typing import TYPE_CHECKING, Any
 
-from homeassistant.components.sensor import SensorEntity
-from homeassistant.core import HomeAssistant, callback
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+from homeassistant.const import (
+    ATTR_LATITUDE,
+    ATTR_LONGITUDE,
+    EntityCategory,
+    UnitOfInformation,
+    UnitOfTime,
+)
+from homeassistant.core import (
+    Event,
+    EventStateChangedData,
+    HomeAssistant,
+    State,
+    callback,
+)
+from homeassistant.helpers import entity_registry as er
 from homeassistant.helpers.device_registry import DeviceInfo
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.event import async_track_state_change_event
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
-from .const import _LOGGER
+from homeassistant.util import dt as dt_util
 
+from .const import (
+    CONF_END,
+    CONF_NEAREST_STATION,
+    CONF_PERSONS,
+    CONF_RECORD_TRAINS,
+    CONF_START,
+    DEFAULT_NEAREST_STATION,
+    DEFAULT_RECORD_TRAINS,
+    SIGNAL_PLATFORMS_CHANGED,
+)
 from .coordinator import MetroDataUpdateCoordinator
-from .metro import MetroPlatform
+from .metrics import MetroMetrics
+from .metro import MetroPlatform, MetroStation
+from .planner import MetroJourneyPlanner
+from .spatial import MetroSpatialIndex
 
 if TYPE_CHECKING:
     from homeassistant.core import HomeAssistant
@@ -27,12 +64,175 @@ async def async_setup_entry(
     async_add_entities: AddEntitiesCallback,
 ) -> None:
     coordinator = entry.runtime_data.coordinator
-    entities: list[SensorEntity] = [
-        MetroPlatformSensor(platform, coordinator=coordinator)
-        for platform in entry.runtime_data.api.list_platforms()
-    ]
+    platform_sensor = (
+        MetroPlatformSensor
+        if entry.options.get(CONF_RECORD_TRAINS, DEFAULT_RECORD_TRAINS)
+        else MetroUnrecordedPlatformSensor
+    )
+    network = entry.runtime_data.api
+    platform_sensors = {
+        (platform.station.station_code, platform.platform_code): platform_sensor(
+            platform, coordinator=coordinator, entry=entry
+        )
+        for platform in network.list_platforms()
+        if entry.runtime_data.is_selected(
+            platform.station.station_code, platform.platform_code
+        )
+    }
+    entities: list[SensorEntity] = list(platform_sensors.values())
+    entities.extend(
+        MetroMetricSensor(description, coordinator=coordinator, entry=entry)
+        for description in METRIC_SENSORS
+    )
+    # Only for the people chosen, who need not have a state yet at startup
+    persons = (
+        entry.options.get(CONF_PERSONS, [])
+        if entry.options.get(CONF_NEAREST_STATION, DEFAULT_NEAREST_STATION)
+        else []
+    )
+    # Drop the sensors of people no longer chosen
+    registry = er.async_get(hass)
+    prefix = f"{entry.entry_id}_{MetroNearestStationSensor.UNIQUE_ID}_"
+    for registry_entry in er.async_entries_for_config_entry(registry, entry.entry_id):
+        if (
+            registry_entry.unique_id.startswith(prefix)
+            and registry_entry.unique_id.removeprefix(prefix) not in persons
+        ):
+            registry.async_remove(registry_entry.entity_id)
+    index = entry.runtime_data.shared.index
+    entities.extend(
+        MetroNearestStationSensor(
+            entity_id, index, coordinator=coordinator, entry=entry
+        )
+        for entity_id in persons
+    )
+    start, end = entry.options.get(CONF_START), entry.options.get(CONF_END)
+    if start in network.stations and end in network.stations and start != end:
+        entities.append(
+            MetroJourneySensor(
+                network.stations[start],
+                network.stations[end],
+                entry.runtime_data.planner,
+                coordinator=coordinator,
+                entry=entry,
+            )
+        )
     async_add_entities(entities)
 
+    @callback
+    def _async_platforms_changed(
+        added: set[tuple[str, str]], removed: set[tuple[str, str]]
+    ) -> None:
+        registry = er.async_get(hass)
+        for key in removed:
+            if (sensor := platform_sensors.pop(key, None)) is None:
+                continue
+            if sensor.registry_entry is not None:
+                registry.async_remove(sensor.entity_id)
+            else:
+                hass.async_create_task(sensor.async_remove())
+        new_sensors = {
+            (station_code, platform_code): platform_sensor(
+                network.stations[station_code].platforms[platform_code],
+                coordinator=coordinator,
+                entry=entry,
+            )
+            for station_code, platform_code in added
+        }
+        platform_sensors.update(new_sensors)
+        async_add_entities(new_sensors.values())
+
+    entry.async_on_unload(
+        async_dispatcher_connect(
+            hass,
+            SIGNAL_PLATFORMS_CHANGED.format(entry.entry_id),
+            _async_platforms_changed,
+        )
+    )
+
+
+@dataclass(frozen=True, kw_only=True)
+class MetroMetricSensorEntityDescription(SensorEntityDescription):
+    value_fn: Callable[[MetroMetrics], float | int | None]
+
+
+def _milliseconds(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+METRIC_SENSORS = (
+    MetroMetricSensorEntityDescription(
+        key="api_requests",
+        name="API requests",
+        icon="mdi:api",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda metrics: metrics.requests,
+    ),
+    MetroMetricSensorEntityDescription(
+        key="api_errors",
+        name="API errors",
+        icon="mdi:alert-circle-outline",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda metrics: metrics.errors,
+    ),
+    MetroMetricSensorEntityDescription(
+        key="api_latency",
+        name="API mean latency",
+        icon="mdi:timer-outline",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda metrics: _milliseconds(metrics.mean_latency),
+    ),
+    MetroMetricSensorEntityDescription(
+        key="api_bytes",
+        name="API data received",
+        icon="mdi:download-network-outline",
+        device_class=SensorDeviceClass.DATA_SIZE,
+        native_unit_of_measurement=UnitOfInformation.BYTES,
+        suggested_unit_of_measurement=UnitOfInformation.KIBIBYTES,
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda metrics: metrics.bytes,
+    ),
+    MetroMetricSensorEntityDescription(
+        key="refresh_duration",
+        name="Refresh duration",
+        icon="mdi:timer-sync-outline",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda metrics: _milliseconds(metrics.refresh_duration),
+    ),
+    MetroMetricSensorEntityDescription(
+        key="platforms_refreshed",
+        name="Platforms refreshed",
+        icon="mdi:refresh",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda metrics: metrics.platforms_refreshed,
+    ),
+    MetroMetricSensorEntityDescription(
+        key="platforms_skipped",
+        name="Platforms skipped",
+        icon="mdi:debug-step-over",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda metrics: metrics.platforms_skipped,
+    ),
+    MetroMetricSensorEntityDescription(
+        key="trains_tracked",
+        name="Trains tracked",
+        icon="mdi:train",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda metrics: metrics.trains_tracked,
+    ),
+)
+
+
+def _device_info(entry: MetroConfigEntry) -> DeviceInfo:
+    return DeviceInfo(
+        name="Tyne and Wear Metro",
+        identifiers={(entry.domain, entry.entry_id)},
+    )
+
 
 class MetroSensor(CoordinatorEntity, SensorEntity):
     _attr_has_entity_name = False
@@ -45,19 +245,13 @@ class MetroSensor(CoordinatorEntity, SensorEntity):
         unique_id: str,
         coordinator: MetroDataUpdateCoordinator,
         context: Any,
+        entry: MetroConfigEntry,
     ) -> None:
         super().__init__(coordinator, context=context)
         self._attr_name = name
-        self._attr_unique_id = unique_id
-        self._attr_device_info = DeviceInfo(
-            name="Tyne and Wear Metro",
-            identifiers={
-                (
-                    coordinator.config_entry.domain,
-                    coordinator.config_entry.entry_id,
-                ),
-            },
-        )
+        # The coordinator may be shared with other entries
+        self._attr_unique_id = f"{entry.entry_id}_{unique_id}"
+        self._attr_device_info = _device_info(entry)
 
 
 class MetroPlatformSensor(MetroSensor):
@@ -67,18 +261,37 @@ class MetroPlatformSensor(MetroSensor):
         self,
         platform: MetroPlatform,
         coordinator: MetroDataUpdateCoordinator,
+        entry: MetroConfigEntry,
     ):
         super().__init__(
             name=f"{platform.station.station_name} platform {platform.platform_code}",
             unique_id=f"metro_{platform.station.station_name}_platform_{platform.platform_code}",
             coordinator=coordinator,
             context=self,
+            entry=entry,
         )
         self._attr_station_code = platform.station.station_code
         self._attr_station_name = platform.station.station_name
         self._attr_platform_code = platform.platform_code
         self._attr_platform_description = platform.platform_description
-        self._subscribed_time: datetime | None = None
+        self._was_available: bool | None = None
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        if self.available == self._was_available and not self.coordinator.has_changed(
+            self._attr_station_code, self._attr_platform_code
+        ):
+            self.coordinator.state_writes_skipped += 1
+            return
+        self._was_available = self.available
+        self.coordinator.state_writes += 1
+        self.async_write_ha_state()
+
+    @property
+    def available(self) -> bool:
+        return super().available and not self.coordinator.is_expired(
+            self._attr_station_code, self._attr_platform_code
+        )
 
     @property
     def state(self) -> str | None:
@@ -89,27 +302,206 @@ class MetroPlatformSensor(MetroSensor):
 
     @property
     def extra_state_attributes(self):
+        # Nothing that changes between refreshes unless the departures do, as
+        # the state is only written when they change
         return {
             "station": self._attr_station_code,
             "station_code": self._attr_station_name,
             "platform": self._attr_platform_code,
             "description": self._attr_platform_description,
-            "last_update": self.coordinator.data.get("last_update", None),
-            "trains": self.coordinator.trains(
+            "stale": self.coordinator.is_stale(
+                self._attr_station_code, self._attr_platform_code
+            ),
+            "trains": self.coordinator.train_attributes(
                 self._attr_station_code, self._attr_platform_code
             ),
         }
 
-    def refresh_params(self):
-        return (
-            self._attr_station_code,
-            self._attr_platform_code,
-            self._subscribed_time,
+    async def async_update(self):
+        self.coordinator.subscribe(self._attr_station_code, self._attr_platform_code)
+        await self.coordinator.async_request_refresh()
+
+
+class MetroUnrecordedPlatformSensor(MetroPlatformSensor):
+    """Platform sensor whose trains are left out of the recorder."""
+
+    _unrecorded_attributes = frozenset({"trains"})
+
+
+class MetroMetricSensor(MetroSensor):
+    """Diagnostic sensor reporting one of the integration's runtime metrics."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    entity_description: MetroMetricSensorEntityDescription
+
+    def __init__(
+        self,
+        description: MetroMetricSensorEntityDescription,
+        coordinator: MetroDataUpdateCoordinator,
+        entry: MetroConfigEntry,
+    ) -> None:
+        super().__init__(
+            name=f"Metro {description.name}",
+            unique_id=f"metro_{description.key}",
+            coordinator=coordinator,
+            context=None,
+            entry=entry,
         )
+        self.entity_description = description
+        self._attr_icon = description.icon
+
+    @property
+    def native_value(self) -> float | int | None:
+        return self.entity_description.value_fn(self.coordinator.api.api.metrics)
+
+
+class MetroJourneySensor(MetroSensor):
+    """When to leave for the fastest journey between two stations."""
+
+    _attr_device_class = SensorDeviceClass.TIMESTAMP
+    _attr_icon = "mdi:map-marker-path"
+
+    def __init__(
+        self,
+        origin: MetroStation,
+        destination: MetroStation,
+        planner: MetroJourneyPlanner,
+        coordinator: MetroDataUpdateCoordinator,
+        entry: MetroConfigEntry,
+    ) -> None:
+        super().__init__(
+            name=f"{origin.station_name} to {destination.station_name}",
+            unique_id=f"metro_journey_{origin.station_code}_{destination.station_code}",
+            coordinator=coordinator,
+            context=None,
+            entry=entry,
+        )
+        self._origin = origin.station_code
+        self._destination = destination.station_code
+        self._planner = planner
+        self._plan: dict[str, Any] | None = None
+        self._replan: asyncio.Task | None = None
+
+    async def async_added_to_hass(self) -> None:
+        await super().async_added_to_hass()
+        await self._async_replan()
+
+    async def _async_replan(self) -> None:
+        # The first build walks every pair of stations, keep it off the loop
+        await self._planner.async_build(self.hass)
+        self._plan = self._planner.plan(
+            self._origin, self._destination, self.coordinator.trains
+        )
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        if self._planner.stale:
+            if self._replan is None or self._replan.done():
+                self._replan = self.hass.async_create_task(
+                    self._async_replan_and_write()
+                )
+            return
+        self._plan = self._planner.plan(
+            self._origin, self._destination, self.coordinator.trains
+        )
+        self.async_write_ha_state()
+
+    async def _async_replan_and_write(self) -> None:
+        await self._async_replan()
+        self.async_write_ha_state()
+
+    @property
+    def native_value(self) -> datetime | None:
+        if self._plan is None or self._plan["departure"] is None:
+            return None
+        return dt_util.as_local(
+            datetime.fromisoformat(self._plan["departure"]["due_time"])
+        )
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        return self._plan
 
     async def async_update(self):
-        self._subscribed_time = datetime.now()
-        # _LOGGER.warning(
-        #     f"{self.coordinator.api.last_update} Requesting refresh for {self._attr_station_code} platform {self._attr_platform_code}"
-        # )
+        await self._planner.async_build(self.hass)
+        for station_code, platform_code in self._planner.platforms(
+            self._origin, self._destination
+        ):
+            if self.coordinator.api.is_selected(station_code, platform_code):
+                self.coordinator.subscribe(station_code, platform_code)
         await self.coordinator.async_request_refresh()
+
+
+class MetroNearestStationSensor(SensorEntity):
+    """The station closest to a person, updated as they move."""
+
+    _attr_has_entity_name = False
+    _attr_icon = "mdi:map-marker-radius"
+    _attr_should_poll = False
+
+    UNIQUE_ID = "metro_nearest_station"
+
+    def __init__(
+        self,
+        entity_id: str,
+        index: MetroSpatialIndex,
+        coordinator: MetroDataUpdateCoordinator,
+        entry: MetroConfigEntry,
+    ) -> None:
+        self._tracked = entity_id
+        self._index = index
+        self._nearest: tuple[str, int] | None = None
+        state = coordinator.hass.states.get(entity_id)
+        self._attr_name = f"{state.name if state else entity_id} nearest Metro station"
+        self._attr_unique_id = f"{entry.entry_id}_{self.UNIQUE_ID}_{entity_id}"
+        self._attr_device_info = _device_info(entry)
+
+    async def async_added_to_hass(self) -> None:
+        self.async_on_remove(
+            async_track_state_change_event(
+                self.hass, [self._tracked], self._async_location_changed
+            )
+        )
+        self._update_from(self.hass.states.get(self._tracked))
+
+    @callback
+    def _async_location_changed(self, event: Event[EventStateChangedData]) -> None:
+        if self._update_from(event.data["new_state"]):
+            self.async_write_ha_state()
+
+    def _update_from(self, state: State | None) -> bool:
+        """Resolve the nearest station, returning whether it changed."""
+        found = None
+        if state is not None:
+            self._attr_name = f"{state.name} nearest Metro station"
+        if (
+            state is not None
+            and (latitude := state.attributes.get(ATTR_LATITUDE)) is not None
+            and (longitude := state.attributes.get(ATTR_LONGITUDE)) is not None
+        ):
+            found = self._index.nearest(latitude, longitude)
+        # Distance to the nearest 10m, so GPS jitter does not write a state
+        nearest = (
+            None if found is None else (found[0].station_code, int(round(found[1], -1)))
+        )
+        if nearest == self._nearest:
+            return False
+        self._nearest = nearest
+        if found is None:
+            self._attr_native_value = None
+            self._attr_extra_state_attributes = {"person": self._tracked}
+            return True
+        station = found[0]
+        self._attr_native_value = station.station_name
+        self._attr_extra_state_attributes = {
+            "person": self._tracked,
+            "station_code": station.station_code,
+            "distance": nearest[1],
+            "platforms": [
+                {"platform": platform_code, "description": description}
+                for platform_code, description in self._index.platforms(
+                    station.station_code
+                )
+            ],
+        }
+        return True
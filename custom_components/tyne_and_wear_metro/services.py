@@ -0,0 +1,239 @@
+"""Services for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+import voluptuous as vol
+
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.const import ATTR_CONFIG_ENTRY_ID
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+)
+from homeassistant.exceptions import ServiceValidationError
+from homeassistant.helpers import config_validation as cv
+
+from .const import DOMAIN, SERVICE_GET_DEPARTURES, SERVICE_PLAN_JOURNEY
+from .metro import MetroNetwork, MetroStationNameException
+
+if TYPE_CHECKING:
+    from .data import MetroConfigEntry
+
+ATTR_ORIGIN = "origin"
+ATTR_DESTINATION = "destination"
+ATTR_STATION = "station"
+ATTR_PLATFORM = "platform"
+ATTR_LIMIT = "limit"
+ATTR_MAX_AGE = "max_age"
+
+PLAN_JOURNEY_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_ORIGIN): cv.string,
+        vol.Required(ATTR_DESTINATION): cv.string,
+        vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string,
+    }
+)
+
+GET_DEPARTURES_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_STATION): cv.string,
+        vol.Optional(ATTR_PLATFORM): cv.string,
+        vol.Optional(ATTR_LIMIT): cv.positive_int,
+        vol.Optional(ATTR_DESTINATION): cv.string,
+        vol.Optional(ATTR_MAX_AGE): cv.positive_time_period,
+        vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string,
+    }
+)
+
+
+def _loaded_entries(call: ServiceCall) -> list[MetroConfigEntry]:
+    """Find the entry asked for, or else every loaded entry."""
+    if (entry_id := call.data.get(ATTR_CONFIG_ENTRY_ID)) is not None:
+        entry = call.hass.config_entries.async_get_entry(entry_id)
+        if (
+            entry is None
+            or entry.domain != DOMAIN
+            or entry.state is not ConfigEntryState.LOADED
+        ):
+            raise ServiceValidationError(
+                translation_domain=DOMAIN,
+                translation_key="entry_not_loaded",
+                translation_placeholders={"entry": entry_id},
+            )
+        return [entry]
+    if entries := [
+        entry
+        for entry in call.hass.config_entries.async_entries(DOMAIN)
+        if entry.state is ConfigEntryState.LOADED
+    ]:
+        return entries
+    raise ServiceValidationError(
+        translation_domain=DOMAIN, translation_key="not_loaded"
+    )
+
+
+def _monitoring(
+    entries: list[MetroConfigEntry],
+    station_code: str,
+    platform_code: str | None = None,
+) -> MetroConfigEntry:
+    """Pick the first entry whose network refreshes the station or platform.
+
+    Entries can use networks with different platforms selected, and only
+    those platforms have departures.
+    """
+    for entry in entries:
+        platforms = entry.runtime_data.api.stations[station_code].platforms
+        if platform_code in platforms or (platform_code is None and platforms):
+            return entry
+    return entries[0]
+
+
+def _station_code(network: MetroNetwork, station: str) -> str:
+    """Accept a station code or name."""
+    if station.upper() in network.stations:
+        return station.upper()
+    try:
+        return network.get_station_by_name(station).station_code
+    except MetroStationNameException as e:
+        raise ServiceValidationError(
+            translation_domain=DOMAIN,
+            translation_key="unknown_station",
+            translation_placeholders={"station": station},
+        ) from e
+
+
+async def _async_plan_journey(call: ServiceCall) -> ServiceResponse:
+    entries = _loaded_entries(call)
+    # Every network has the same stations, only their platforms differ
+    origin = _station_code(entries[0].runtime_data.api, call.data[ATTR_ORIGIN])
+    destination = _station_code(
+        entries[0].runtime_data.api, call.data[ATTR_DESTINATION]
+    )
+    data = _monitoring(entries, origin).runtime_data
+    network, coordinator, planner = data.api, data.coordinator, data.planner
+    await planner.async_build(call.hass)
+    # Fetch departures for any platform the journey could start from that
+    # has none yet, the rest keep refreshing on their own schedule
+    waiting = False
+    for station_code, platform_code in planner.platforms(origin, destination):
+        if not network.is_selected(station_code, platform_code):
+            continue
+        coordinator.subscribe(station_code, platform_code)
+        if coordinator.data["refreshed"][station_code][platform_code] is None:
+            waiting = True
+    if waiting:
+        await coordinator.async_refresh()
+    plan = planner.plan(origin, destination, coordinator.trains)
+    return {"journey": plan}
+
+
+def _calls_at(
+    network: MetroNetwork,
+    station_code: str,
+    platform_code: str,
+    train: dict[str, Any],
+    destination_code: str,
+) -> bool:
+    """Whether a train leaving this platform stops at the destination."""
+    if train["destination_code"] == destination_code:
+        return True
+    route = network.routes.get(train["line"].upper(), [])
+    direction = network.platform_data.get((station_code, platform_code), {}).get(
+        "direction"
+    )
+    if direction is None or not {
+        station_code,
+        destination_code,
+        train["destination_code"],
+    }.issubset(route):
+        return False
+    step = 1 if direction == "IN" else -1
+    here = route.index(station_code)
+    return (
+        0
+        < (route.index(destination_code) - here) * step
+        <= (route.index(train["destination_code"]) - here) * step
+    )
+
+
+async def _async_get_departures(call: ServiceCall) -> ServiceResponse:
+    entries = _loaded_entries(call)
+    station_code = _station_code(entries[0].runtime_data.api, call.data[ATTR_STATION])
+    platform_code = call.data.get(ATTR_PLATFORM)
+    data = _monitoring(entries, station_code, platform_code).runtime_data
+    network, coordinator = data.api, data.coordinator
+    platforms = network.stations[station_code].platforms
+    if not platforms:
+        # Otherwise indistinguishable from no trains being due
+        raise ServiceValidationError(
+            translation_domain=DOMAIN,
+            translation_key="station_not_monitored",
+            translation_placeholders={"station": station_code},
+        )
+    if platform_code is not None:
+        if platform_code not in platforms:
+            raise ServiceValidationError(
+                translation_domain=DOMAIN,
+                translation_key="unknown_platform",
+                translation_placeholders={
+                    "station": station_code,
+                    "platform": platform_code,
+                },
+            )
+        platform_codes = [platform_code]
+    else:
+        platform_codes = sorted(platforms)
+    destination_code = (
+        _station_code(network, call.data[ATTR_DESTINATION])
+        if ATTR_DESTINATION in call.data
+        else None
+    )
+    await coordinator.async_ensure_fresh(
+        [(station_code, code) for code in platform_codes],
+        call.data.get(ATTR_MAX_AGE),
+    )
+    departures = [
+        departure
+        for code in platform_codes
+        for departure in coordinator.departures(station_code, code)
+        if destination_code is None
+        or _calls_at(network, station_code, code, departure, destination_code)
+    ]
+    if len(platform_codes) > 1:
+        departures.sort(key=lambda departure: departure["due_in"])
+    if (limit := call.data.get(ATTR_LIMIT)) is not None:
+        departures = departures[:limit]
+    refreshed = coordinator.data["refreshed"][station_code]
+    return {
+        "station": station_code,
+        "platforms": {
+            code: {
+                "refreshed": refreshed[code] and refreshed[code].isoformat(),
+                "stale": coordinator.is_stale(station_code, code),
+            }
+            for code in platform_codes
+        },
+        "departures": departures,
+    }
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_PLAN_JOURNEY,
+        _async_plan_journey,
+        schema=PLAN_JOURNEY_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_DEPARTURES,
+        _async_get_departures,
+        schema=GET_DEPARTURES_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
@@ -0,0 +1,301 @@
+"""Networks shared by Tyne and Wear Metro config entries."""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Mapping
+from datetime import datetime, timedelta
+import hashlib
+import json
+from typing import TYPE_CHECKING, Any
+
+import aiohttp
+
+from homeassistant.core import callback
+from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.helpers.event import async_call_later, async_track_time_interval
+
+from .const import (
+    _LOGGER,
+    CAPTURE_FILE,
+    CONF_APPROACH_DISTANCE,
+    CONF_CAPTURE,
+    CONF_END,
+    CONF_HISTORY,
+    CONF_LIMIT_PER_HOST,
+    CONF_NEAREST_STATION,
+    CONF_PERSONS,
+    CONF_PLATFORMS,
+    CONF_PRESENCE_LEASE_LENGTH,
+    CONF_RECORD_TRAINS,
+    CONF_START,
+    CONF_STATIONS,
+    CONF_TIMEOUT,
+    CONF_TRAIN_TTL,
+    DEFAULT_CAPTURE,
+    DEFAULT_HISTORY,
+    DEFAULT_LIMIT_PER_HOST,
+    DEFAULT_OPTIONS,
+    DEFAULT_TIMEOUT,
+    DEFAULT_TRAIN_TTL,
+    DOMAIN,
+    HISTORY_FILE,
+)
+from .coordinator import MetroDataUpdateCoordinator
+from .data import selected_platforms
+from .metro import MetroAPI, MetroNetwork
+from .planner import MetroJourneyPlanner
+from .spatial import MetroSpatialIndex
+
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
+    from .data import MetroConfigEntry
+
+# Options that only decide which entities an entry has, entries that agree on
+# everything else share a network
+ENTRY_OPTIONS = (
+    CONF_STATIONS,
+    CONF_PLATFORMS,
+    CONF_START,
+    CONF_END,
+    CONF_NEAREST_STATION,
+    CONF_RECORD_TRAINS,
+    CONF_PERSONS,
+    CONF_PRESENCE_LEASE_LENGTH,
+    CONF_APPROACH_DISTANCE,
+)
+
+
+def shared_options(options: Mapping[str, Any]) -> dict[str, Any]:
+    return {
+        key: value
+        for key, value in {**DEFAULT_OPTIONS, **options}.items()
+        if key not in ENTRY_OPTIONS
+    }
+
+
+class MetroShared:
+    """A network, coordinator, planner and index used by one or more entries."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        key: str,
+        network: MetroNetwork,
+        coordinator: MetroDataUpdateCoordinator,
+    ) -> None:
+        self.hass, self.key = hass, key
+        self.network, self.coordinator = network, coordinator
+        self.planner = MetroJourneyPlanner(network, coordinator.inference)
+        self.index = MetroSpatialIndex(network)
+        # Platforms chosen by each entry using it, None for every platform
+        self.selections: dict[str, set[tuple[str, str]] | None] = {}
+        self.unsubscribers: list[Callable[[], None]] = []
+        self.tasks: list[asyncio.Task] = []
+        self.cancel_close: Callable[[], None] | None = None
+
+    @property
+    def selection(self) -> set[tuple[str, str]] | None:
+        """Every platform chosen by any entry."""
+        if any(selection is None for selection in self.selections.values()):
+            return None
+        return set().union(*self.selections.values())
+
+    async def async_select(
+        self, entry_id: str, selection: set[tuple[str, str]] | None
+    ) -> None:
+        """Change what one entry has chosen and hydrate the union."""
+        self.selections[entry_id] = selection
+        await self._async_hydrate_selection()
+
+    async def async_forget(self, entry_id: str) -> None:
+        """Drop the platforms only one entry had chosen."""
+        self.selections.pop(entry_id, None)
+        if self.selections:
+            await self._async_hydrate_selection()
+
+    async def _async_hydrate_selection(self) -> None:
+        _, removed = await self.network.select(self.selection)
+        for station_code, platform_code in removed:
+            self.coordinator.unsubscribe(station_code, platform_code)
+
+    async def async_close(self) -> None:
+        for unsubscribe in self.unsubscribers:
+            unsubscribe()
+        for task in self.tasks:
+            task.cancel()
+        await self.coordinator.async_shutdown()
+        if (history := self.coordinator.history) is not None:
+            await history.async_close()
+        await self.network.close()
+
+
+class MetroSharedNetworks:
+    """The shared networks, kept while any entry uses them.
+
+    An entry takes a reference when it is set up and gives it back when it is
+    unloaded. The last one out leaves the network running for LINGER first,
+    so that reloading an entry picks it straight back up instead of hydrating
+    again.
+    """
+
+    LINGER = timedelta(minutes=1)
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self.shared: dict[str, MetroShared] = {}
+        # Capture and history files by the key of the network writing them
+        self.files: dict[str, str] = {}
+        # Entries are set up concurrently, only one of them may create each
+        # network
+        self._lock = asyncio.Lock()
+        self.created, self.reused = 0, 0
+
+    @staticmethod
+    def key(options: Mapping[str, Any]) -> str:
+        return json.dumps(shared_options(options), sort_keys=True, default=str)
+
+    async def async_acquire(self, entry: MetroConfigEntry) -> MetroShared:
+        key = self.key(entry.options)
+        selection = selected_platforms(entry.options)
+        async with self._lock:
+            if (shared := self.shared.get(key)) is not None:
+                if shared.cancel_close is not None:
+                    shared.cancel_close()
+                    shared.cancel_close = None
+                await shared.async_select(entry.entry_id, selection)
+                self.reused += 1
+                return shared
+            shared = await self._async_create(key, entry.options, selection)
+            shared.selections[entry.entry_id] = selection
+            self.shared[key] = shared
+            self.created += 1
+            return shared
+
+    async def async_release(
+        self, entry_id: str, shared: MetroShared, linger: bool = True
+    ) -> None:
+        async with self._lock:
+            await shared.async_forget(entry_id)
+            if shared.selections:
+                return
+            if not linger:
+                self._remove(shared)
+                await shared.async_close()
+                return
+
+        @callback
+        def _async_close(_now: datetime) -> None:
+            shared.cancel_close = None
+            if self.shared.get(shared.key) is shared and not shared.selections:
+                self._remove(shared)
+                self.hass.async_create_task(shared.async_close())
+
+        shared.cancel_close = async_call_later(self.hass, self.LINGER, _async_close)
+
+    async def async_close_unused(self) -> None:
+        """Close networks no entry uses without waiting out LINGER."""
+        async with self._lock:
+            for shared in list(self.shared.values()):
+                if not shared.selections:
+                    if shared.cancel_close is not None:
+                        shared.cancel_close()
+                    self._remove(shared)
+                    await shared.async_close()
+
+    def _remove(self, shared: MetroShared) -> None:
+        del self.shared[shared.key]
+        self._release_files(shared.key)
+
+    def _release_files(self, key: str) -> None:
+        for path in [path for path, owner in self.files.items() if owner == key]:
+            del self.files[path]
+
+    def _path(self, filename: str, key: str) -> str:
+        """Find a file in the config directory that no other network writes.
+
+        The first network to want one gets the plain name, and any others
+        get the name suffixed with a hash of their options.
+        """
+        path = self.hass.config.path(filename)
+        if self.files.get(path, key) != key:
+            stem, _, suffix = filename.partition(".")
+            digest = hashlib.sha256(key.encode()).hexdigest()[:8]
+            path = self.hass.config.path(f"{stem}_{digest}.{suffix}")
+        self.files[path] = key
+        return path
+
+    async def _async_create(
+        self,
+        key: str,
+        options: Mapping[str, Any],
+        selection: set[tuple[str, str]] | None,
+    ) -> MetroShared:
+        capture_path = (
+            self._path(CAPTURE_FILE, key)
+            if options.get(CONF_CAPTURE, DEFAULT_CAPTURE)
+            else None
+        )
+        history_path = (
+            self._path(HISTORY_FILE, key)
+            if options.get(CONF_HISTORY, DEFAULT_HISTORY)
+            else None
+        )
+        try:
+            network = MetroNetwork(
+                MetroAPI(
+                    limit_per_host=options.get(
+                        CONF_LIMIT_PER_HOST, DEFAULT_LIMIT_PER_HOST
+                    ),
+                    timeout=options.get(CONF_TIMEOUT, DEFAULT_TIMEOUT),
+                    capture_path=capture_path,
+                ),
+                train_ttl=timedelta(
+                    minutes=options.get(CONF_TRAIN_TTL, DEFAULT_TRAIN_TTL)
+                ),
+                selection=selection,
+            )
+            await network.hydrate()
+            coordinator = MetroDataUpdateCoordinator(
+                self.hass,
+                name=DOMAIN,
+                api=network,
+                options=options,
+                history_path=history_path,
+            )
+            await coordinator.async_refresh()
+        except BaseException:
+            self._release_files(key)
+            raise
+        if not coordinator.last_update_success:
+            self._release_files(key)
+            await network.close()
+            raise ConfigEntryNotReady(coordinator.last_exception)
+        shared = MetroShared(self.hass, key, network, coordinator)
+        shared.tasks.append(
+            self.hass.async_create_background_task(
+                _async_revalidate_topology(network), f"{DOMAIN} topology revalidation"
+            )
+        )
+        if (history := coordinator.history) is not None:
+
+            async def _async_purge_history(_now: datetime) -> None:
+                await history.async_purge()
+
+            shared.unsubscribers.append(
+                async_track_time_interval(
+                    self.hass, _async_purge_history, timedelta(days=1)
+                )
+            )
+        return shared
+
+
+async def _async_revalidate_topology(api: MetroNetwork) -> None:
+    try:
+        changed = await api.revalidate()
+    except (aiohttp.ClientError, TimeoutError) as e:
+        _LOGGER.debug("Could not revalidate the Metro topology: %s", e)
+        return
+    if changed:
+        _LOGGER.info("Metro topology has changed, rebuilt from the API")
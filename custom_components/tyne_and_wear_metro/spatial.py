@@ -0,0 +1,134 @@
+"""Nearest station lookups for the Tyne and Wear Metro integration."""
+
+from __future__ import annotations
+
+from collections import defaultdict
+import math
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .metro import MetroNetwork, MetroStation
+
+EARTH_RADIUS = 6371000.0
+
+
+def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great circle distance in metres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class MetroSpatialIndex:
+    """A grid over station locations, searched outwards from a point.
+
+    Cells are CELL_SIZE degrees square, which is about 1.1km by 0.6km this far
+    north. A lookup visits rings of cells around the point until the nearest
+    station found is closer than anything the next ring could hold.
+    """
+
+    CELL_SIZE = 0.01
+    # Metres per degree of latitude, scaled by cos(latitude) for longitude
+    METRES_PER_DEGREE = 111000.0
+
+    def __init__(self, network: MetroNetwork) -> None:
+        self.network = network
+        self._cells: dict[tuple[int, int], list[tuple[float, float, str]]] = {}
+        # Platform codes and descriptions by station
+        self._platforms: dict[str, list[tuple[str, str]]] = {}
+        self._bounds = (0, 0, 0, 0)
+        self._topology: str | None = None
+
+    def _cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return (
+            math.floor(latitude / self.CELL_SIZE),
+            math.floor(longitude / self.CELL_SIZE),
+        )
+
+    def _build(self) -> None:
+        points: defaultdict[str, list[tuple[float, float]]] = defaultdict(list)
+        platforms: defaultdict[str, list[tuple[str, str]]] = defaultdict(list)
+        for (
+            station_code,
+            platform_code,
+        ), platform in self.network.platform_data.items():
+            platforms[station_code].append((platform_code, platform["helperText"]))
+            coordinates = platform.get("coordinates", {})
+            if "latitude" in coordinates:
+                points[station_code].append(
+                    (coordinates["latitude"], coordinates["longitude"])
+                )
+        cells = defaultdict(list)
+        for station_code, station_points in points.items():
+            latitude = sum(lat for lat, _ in station_points) / len(station_points)
+            longitude = sum(lon for _, lon in station_points) / len(station_points)
+            cells[self._cell(latitude, longitude)].append(
+                (latitude, longitude, station_code)
+            )
+        self._cells, self._platforms = dict(cells), dict(platforms)
+        if self._cells:
+            rows = [row for row, _ in self._cells]
+            columns = [column for _, column in self._cells]
+            self._bounds = (min(rows), max(rows), min(columns), max(columns))
+        self._topology = self.network.topology_fingerprint
+
+    def platforms(self, station_code: str) -> list[tuple[str, str]]:
+        """List a station's platform codes and descriptions."""
+        if self._topology != self.network.topology_fingerprint:
+            self._build()
+        return self._platforms.get(station_code, [])
+
+    def nearest(
+        self, latitude: float, longitude: float
+    ) -> tuple[MetroStation, float] | None:
+        """Find the closest station to a point and its distance in metres."""
+        if self._topology != self.network.topology_fingerprint:
+            self._build()
+        if not self._cells:
+            return None
+        row, column = self._cell(latitude, longitude)
+        min_row, max_row, min_column, max_column = self._bounds
+        # Only rings between the nearest and furthest edge of the grid can
+        # hold a station, which matters for points well outside the network
+        first = max(
+            0, min_row - row, row - max_row, min_column - column, column - max_column
+        )
+        last = max(
+            abs(row - min_row),
+            abs(row - max_row),
+            abs(column - min_column),
+            abs(column - max_column),
+        )
+        side = (
+            self.CELL_SIZE * self.METRES_PER_DEGREE * math.cos(math.radians(latitude))
+        )
+        best: tuple[float, str] | None = None
+        for ring in range(first, last + 1):
+            for cell in self._ring(row, column, ring):
+                for lat, lon, station_code in self._cells.get(cell, ()):
+                    metres = distance(latitude, longitude, lat, lon)
+                    if best is None or metres < best[0]:
+                        best = (metres, station_code)
+            # Anything in the next ring is at least this far away
+            if best is not None and best[0] <= ring * side:
+                break
+        if best is None:
+            return None
+        return self.network.stations[best[1]], best[0]
+
+    def _ring(self, row: int, column: int, ring: int):
+        """Cells of the square ring around a cell, clipped to the grid."""
+        min_row, max_row, min_column, max_column = self._bounds
+        left, right = max(column - ring, min_column), min(column + ring, max_column)
+        for edge in {row - ring, row + ring}:
+            if min_row <= edge <= max_row:
+                for c in range(left, right + 1):
+                    yield (edge, c)
+        top, bottom = max(row - ring + 1, min_row), min(row + ring - 1, max_row)
+        for edge in {column - ring, column + ring}:
+            if min_column <= edge <= max_column:
+                for r in range(top, bottom + 1):
+                    yield (r, edge)
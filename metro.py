@@ -1,9 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import io
 import json
+from pathlib import Path
+import threading
+import time
 
 import aiofiles
 from PIL import Image, ImageDraw
 import requests  # , requests_cache
+from requests.adapters import HTTPAdapter
 
 
 class MetroNetwork:
@@ -54,6 +60,63 @@ class MetroNetwork:
         else:
             self.stations[station].update(platform)
 
+    def sweep(self, workers=8):
+        """Fetch every platform in parallel and return a snapshot of the result.
+
+        Only the requests run in the pool, the responses are applied to the
+        network one at a time afterwards so trains are never updated from two
+        threads at once.
+        """
+        platforms = [
+            platform
+            for station in self.stations.values()
+            for platform in station.platforms.values()
+        ]
+        taken_at = datetime.now()
+        results, errors = {}, {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                platform: executor.submit(
+                    self.api.get_times, platform.station.code, platform.number
+                )
+                for platform in platforms
+            }
+            for platform, future in futures.items():
+                try:
+                    results[platform] = future.result()
+                except requests.RequestException as e:
+                    errors[platform] = e
+        for platform, train_datas in results.items():
+            platform.arrivals = [
+                self.add_train(platform, train_data) for train_data in train_datas
+            ]
+        return self.snapshot(taken_at, errors)
+
+    def snapshot(self, taken_at=None, errors=None):
+        return MetroSnapshot(
+            taken_at or datetime.now(),
+            {
+                number: {
+                    "line": train.line,
+                    "destination": train.destination,
+                    "event": train.position[0],
+                    "x": train.x,
+                    "y": train.y,
+                    "d": train.d,
+                    "colour": train.colour,
+                }
+                for number, train in self.trains.items()
+            },
+            {
+                (platform.station.code, platform.number): [
+                    (train.id, arrival["dueIn"]) for train, arrival in platform.arrivals
+                ]
+                for station in self.stations.values()
+                for platform in station.platforms.values()
+            },
+            errors or {},
+        )
+
     def add_train(self, platform, train_data):
         if train_data["trn"] in self.trains:
             train = self.trains[train_data["trn"]]
@@ -63,16 +126,39 @@ class MetroNetwork:
             self.trains[train.id] = train
         return train.arrival(platform)
 
-    def print_map(self):
-        map = MetroMap()
-        for number, train in self.trains.items():
-            map.add_train(number, (train.x, train.y), train.d, train.colour)
+    def print_map(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot()
+        map = MetroMap(snapshot.taken_at)
+        for number, train in snapshot.trains.items():
+            map.add_train(number, (train["x"], train["y"]), train["d"], train["colour"])
         map.save()
 
     def __repr__(self):
         return "\n\n".join(f"{station}" for station in self.stations.values())
 
 
+class MetroSnapshot:
+    """The state of the whole network as of one sweep."""
+
+    def __init__(self, taken_at, trains, arrivals, errors):
+        self.taken_at = taken_at
+        self.trains = trains
+        self.arrivals = arrivals
+        self.errors = errors
+
+    @property
+    def age(self):
+        return datetime.now() - self.taken_at
+
+    def __repr__(self):
+        """Summarise the sweep in one line."""
+        return (
+            f"Snapshot at {self.taken_at:%H:%M:%S}, {len(self.trains)} trains, "
+            f"{len(self.arrivals)} platforms, {len(self.errors)} errors"
+        )
+
+
 class MetroStation:
     def __init__(self, network, name, code, platforms=None):
         self.network, self.name, self.code = network, name, code
@@ -234,8 +320,19 @@ class MetroMap:
         "D": [(-6, -9), (5, 8), (6, 1), (0, 5), (8, 8)],
     }
 
-    def __init__(self):
+    BASE = None
+
+    def __init__(self, updated=None):
         self.trains = []
+        self.updated = updated
+
+    @classmethod
+    def base(cls):
+        # Decoded once and copied for each render
+        if cls.BASE is None:
+            with Image.open("map.png") as im:
+                cls.BASE = im.copy()
+        return cls.BASE
 
     def add_train(self, name, position, direction, colour="red"):
         self.trains.append(
@@ -269,34 +366,67 @@ class MetroMap:
         )
         return parts
 
-    def save(self):
-        with Image.open("map.png") as im:
-            draw = ImageDraw.Draw(im)
-            for train in self.trains:
-                os = self.OFFSETS[train["direction"]]
-                for f, t in self.arrow_parts(train["position"], os):
-                    draw.line([f, t], fill=train["colour"], width=4)
-                draw.text(
-                    (train["position"][0] + os[4][0], train["position"][1] + os[4][1]),
-                    train["name"],
-                    fill=train["colour"],
-                )
+    def render(self):
+        im = self.base().copy()
+        draw = ImageDraw.Draw(im)
+        for train in self.trains:
+            os = self.OFFSETS[train["direction"]]
+            (tail, head), (_, left), (_, right) = self.arrow_parts(
+                train["position"], os
+            )
+            draw.line([tail, head, left, head, right], fill=train["colour"], width=4)
             draw.text(
-                (200, 400),
-                f"Last Updated {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                fill="black",
+                (train["position"][0] + os[4][0], train["position"][1] + os[4][1]),
+                train["name"],
+                fill=train["colour"],
             )
-            im.save("map-annotated.png")
+        draw.text(
+            (200, 400),
+            f"Last Updated {(self.updated or datetime.now()).strftime('%Y-%m-%d %H:%M')}",
+            fill="black",
+        )
+        buffer = io.BytesIO()
+        im.save(buffer, "PNG", compress_level=1)
+        return buffer.getvalue()
+
+    def save(self, path="map-annotated.png"):
+        Path(path).write_bytes(self.render())
+
+
+class RateLimiter:
+    """Space calls at least 1/rate seconds apart, across all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
 
 
 class MetroAPI:
     API_BASE = "https://metro-rti.nexus.org.uk/api/"
+    POOL_SIZE = 8
+    RATE = 10  # requests per second
+    TIMEOUT = 10
 
     def __init__(self):
-        pass
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.limiter = RateLimiter(self.RATE)
 
     def get_json(self, path):
-        r = requests.get(f"{self.API_BASE}{path}")
+        self.limiter.wait()
+        r = self.session.get(f"{self.API_BASE}{path}", timeout=self.TIMEOUT)
+        r.raise_for_status()
         return r.json()
 
     def get_times(self, station_code, platform_number):
@@ -326,8 +456,9 @@ class MetroAPI:
 def main():
     # requests_cache.install_cache('metro_cache')
     m = MetroNetwork()
-    m.update()
-    m.print_map()
+    snapshot = m.sweep(workers=MetroAPI.POOL_SIZE)
+    print(snapshot)  # noqa: T201
+    m.print_map(snapshot)
 
 
 if __name__ == "__main__":